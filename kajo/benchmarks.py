@@ -0,0 +1,746 @@
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmarks for the hot paths of utils.
+
+    $ python benchmarks.py               # run all
+    $ python benchmarks.py lazy_record   # run those matching the name
+"""
+
+import os
+import re
+import sys
+import copy
+import json
+import timeit
+import datetime
+import tempfile
+import tracemalloc
+import urllib.parse
+from collections.abc import MutableMapping
+
+from utils import containers
+from utils import cmd
+from utils import textutils
+
+
+def measure(func, number=1, repeat=5):
+    """Returns the best time (sec) of `repeat` runs of `number` calls."""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def report(label, baseline, candidate, unit='ms'):
+    factor = {'s': 1, 'ms': 1000, 'us': 1000000}[unit]
+    print('{:<40} {:10.3f} {unit}  {:10.3f} {unit}  x{:.1f}'.format(
+        label,
+        baseline * factor,
+        candidate * factor,
+        baseline / candidate if candidate else float('inf'),
+        unit=unit))
+
+
+def make_document(depth=4, width=5, leaves=4):
+    """Nested document of `width` ** `depth` branches."""
+    if depth == 0:
+        return {'leaf_{}'.format(i): [i, str(i), {'x': i}] for i in range(leaves)}
+    return {'node_{}'.format(i): make_document(depth - 1, width, leaves)
+            for i in range(width)}
+
+
+def bench_lazy_recorddict():
+    print('RecordDict vs. LazyRecordDict (construct + read one path)')
+    for depth in (2, 3, 4):
+        doc = make_document(depth=depth)
+
+        def eager():
+            obj = containers.RecordDict(**doc)
+            return obj.node_0
+
+        def lazy():
+            obj = containers.LazyRecordDict(**doc)
+            return obj.node_0
+
+        report('depth={}'.format(depth), measure(eager), measure(lazy))
+
+
+def bench_lookup():
+    print('RecordDict.lookup per record vs. lookup_many (10k records, 3 paths)')
+    paths = ('node_0.node_1.leaf_0', 'node_2.leaf_3', 'node_1.missing')
+    records = [containers.RecordDict(**make_document(depth=2, width=3))
+               for _ in range(10000)]
+
+    def per_record():
+        return [[rec.lookup(path) for path in paths] for rec in records]
+
+    def batch():
+        return containers.lookup_many(records, *paths)
+
+    report('lookup', measure(per_record), measure(batch))
+
+
+def allocated(func):
+    """Returns the memory (bytes) retained by the result of `func`."""
+    tracemalloc.start()
+    result = func()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def bench_record_batch():
+    print('list of RecordDict vs. RecordBatch (100k rows, retained memory)')
+    records = [{'id': i, 'score': i / 7., 'tag': 'tag_{}'.format(i % 10),
+                'geo': {'lat': 50.6 + i, 'lon': 4.6 - i}}
+               for i in range(100000)]
+    baseline = allocated(
+        lambda: [containers.RecordDict(**rec) for rec in records])
+    candidate = allocated(
+        lambda: containers.RecordBatch.from_records(records))
+    print('{:<40} {:10.1f} MB  {:10.1f} MB  x{:.1f}'.format(
+        'memory', baseline / 2**20, candidate / 2**20, baseline / candidate))
+
+
+def _flatten_dict_recursive(dict_, parent_key='', separator='_'):
+    """Reference: the former recursive implementation of flatten_dict."""
+    items = []
+    for key, val in dict_.items():
+        new_key = '{0}{1}{2}'.format(parent_key, separator, key) if parent_key else key
+        if isinstance(val, MutableMapping):
+            items.extend(
+                _flatten_dict_recursive(val, new_key, separator=separator).items()
+                )
+        else:
+            items.append((new_key, val))
+
+    return dict(items)
+
+
+def bench_flatten():
+    print('recursive flatten_dict vs. flatten_many (1k records, 64 leaves)')
+    for depth in (1, 2, 3, 6):
+        width = max(2, round(64 ** (1. / depth)))
+        records = [make_document(depth=depth, width=width, leaves=1)
+                   for _ in range(1000)]
+
+        def recursive():
+            return [_flatten_dict_recursive(rec) for rec in records]
+
+        def iterative():
+            return list(containers.flatten_many(records))
+
+        report('depth={} width={}'.format(depth, width),
+               measure(recursive), measure(iterative))
+
+
+def _sniff_json(val):
+    try:
+        json.dumps(val)
+    except TypeError:
+        return False
+    return True
+
+
+def _serialize_sniffing(branch):
+    """Reference: the former prepare_to_serialize, test-encoding every node."""
+    if _sniff_json(branch):
+        return branch
+
+    if isinstance(branch, dict):
+        return dict((key, _serialize_sniffing(val)) for key, val in branch.items())
+    if isinstance(branch, (list, tuple)):
+        return [_serialize_sniffing(elem) for elem in branch]
+    if isinstance(branch, datetime.datetime):
+        return branch.isoformat()
+    return str(branch)
+
+
+def bench_serialize():
+    print('sniffing prepare_to_serialize vs. single pass (json.dumps included)')
+    now = datetime.datetime(2020, 4, 18, 20, 36, 43)
+    for depth in (2, 3, 4):
+        doc = make_document(depth=depth)
+        doc['node_0']['created'] = now
+
+        def sniffing():
+            return json.dumps(_serialize_sniffing(doc))
+
+        def single_pass():
+            return containers.to_json(doc)
+
+        report('depth={}'.format(depth), measure(sniffing), measure(single_pass))
+
+
+def peak_memory(func):
+    """Returns the peak memory (bytes) allocated while running `func`."""
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def bench_ndjson():
+    print('in-memory json.dumps list vs. write_ndjson (100k records)')
+    now = datetime.datetime(2020, 4, 18, 20, 36, 43)
+    records = [{'id': i, 'created': now, 'tag': 'tag_{}'.format(i % 10),
+                'geo': {'lat': 50.6 + i, 'lon': 4.6 - i}}
+               for i in range(100000)]
+
+    with tempfile.TemporaryDirectory() as path:
+        def in_memory():
+            lines = [json.dumps(containers.prepare_to_serialize(dict(rec)))
+                     for rec in records]
+            with open(os.path.join(path, 'list.ndjson'), 'w') as fp:
+                fp.write('\n'.join(lines))
+
+        baseline = measure(in_memory, repeat=3)
+        baseline_peak = peak_memory(in_memory)
+        size = os.path.getsize(os.path.join(path, 'list.ndjson')) / 2**20
+        for name in ('records.ndjson', 'records.ndjson.gz'):
+            filename = os.path.join(path, name)
+            streaming = lambda: cmd.write_ndjson(records, filename)
+            candidate = measure(streaming, repeat=3)
+            report(name, baseline, candidate)
+            print('{:<40} {:10.1f} MB/s  {:10.1f} MB/s  (of JSON)'.format(
+                '', size / baseline, size / candidate))
+            print('{:<40} {:10.1f} MB    {:10.1f} MB    (peak memory)'.format(
+                '', baseline_peak / 2**20, peak_memory(streaming) / 2**20))
+
+
+def bench_deep_merge():
+    print('deepcopy + deep_update vs. deep_merge (per-request override)')
+    override = {'node_0': {'node_1': {'leaf_0': 'overridden'}}, 'debug': True}
+    for depth in (2, 3, 4):
+        base = make_document(depth=depth)
+
+        def deepcopy_update():
+            return containers.deep_update(copy.deepcopy(base), override)
+
+        def merge():
+            return containers.deep_merge(base, override)
+
+        report('depth={}'.format(depth), measure(deepcopy_update), measure(merge),
+               unit='us')
+
+
+def _normalize_keys_resub(dict_, lowercase=True, separator='_'):
+    """Reference: the former normalize_keys, re.sub on every key."""
+    normalized = {}
+    for key, val in dict_.items():
+        new_key = re.sub('[^A-Za-z0-9]+', separator, key)
+        new_key = new_key.lower() if lowercase else new_key
+        if isinstance(val, dict):
+            val = _normalize_keys_resub(val, lowercase, separator)
+        normalized[new_key] = val
+
+    return normalized
+
+
+def bench_normalize_keys():
+    print('re.sub per key vs. normalize_keys_many (100k HTTP headers)')
+    headers = {'Content-Type': 'text/html', 'Last-Modified': 'Sat, 04 Apr',
+               'Cache-Control': 'no-cache', 'X-Forwarded-For': '127.0.0.1',
+               'Set-Cookie': {'Max-Age': 60, 'Http-Only': True}}
+    records = [headers] * 100000
+
+    def resub():
+        return [_normalize_keys_resub(rec) for rec in records]
+
+    def cached():
+        return list(containers.normalize_keys_many(records))
+
+    containers.normalize_key.cache_clear()
+    report('normalize_keys', measure(resub, repeat=3), measure(cached, repeat=3))
+    print('{:<40} hit rate {:.4f}'.format(
+        '', containers.normalize_keys_cache_info().hit_rate))
+
+
+def zipf_stream(size, distinct, seed=1):
+    """Skewed stream of `size` topics drawn from `distinct` ones."""
+    import random
+    rnd = random.Random(seed)
+    weights = [1. / rank for rank in range(1, distinct + 1)]
+    return ['topic_{}'.format(i)
+            for i in rnd.choices(range(distinct), weights, k=size)]
+
+
+def bench_top_occurences():
+    print('compress_and_sort_by_occurence vs. top_occurences (top 20)')
+    stream = zipf_stream(500000, 200000)
+
+    def full():
+        return containers.compress_and_sort_by_occurence(stream)[:20]
+
+    def streaming():
+        return containers.top_occurences(stream, limit=20)
+
+    def exact():
+        return containers.top_occurences(stream, limit=20, exact=True)
+
+    baseline = measure(full, repeat=3)
+    report('500k items, 200k distinct', baseline, measure(streaming, repeat=3))
+    report('exact', baseline, measure(exact, repeat=3))
+    print('{:<40} {:10.1f} MB  {:10.1f} MB  (peak memory)'.format(
+        '', peak_memory(full) / 2**20, peak_memory(streaming) / 2**20))
+    print('{:<40} top 20 match: {}'.format('', full() == streaming()))
+
+
+def bench_count_distinct():
+    print('distinct_elements vs. count_distinct (1M URLs, 300k distinct)')
+    urls = ['https://example.com/page/{}'.format(i % 300000)
+            for i in range(1000000)]
+
+    def exact():
+        return len(containers.distinct_elements(urls))
+
+    def approx():
+        return containers.count_distinct(urls)
+
+    report('count', measure(exact, repeat=1), measure(approx, repeat=1))
+    print('{:<40} {:10.1f} MB  {:10.1f} MB  (peak memory)'.format(
+        '', peak_memory(exact) / 2**20, peak_memory(approx) / 2**20))
+    print('{:<40} error {:.2%}'.format('', approx() / exact() - 1))
+
+
+def bench_group_by():
+    print('from_list_aggregate + mean vs. group_by (200k records, 100 groups)')
+    records = [{'label': 'label_{}'.format(i % 100), 'score': i % 7}
+               for i in range(200000)]
+
+    def aggregate():
+        groups = containers.RecordDict.from_list_aggregate(
+            records, key='label', val='score')
+        return dict((key, sum(val) / len(val)) for key, val in groups.items())
+
+    def streaming():
+        return containers.group_by(iter(records), 'label',
+                                   {'avg': ('mean', 'score')})
+
+    report('mean per label', measure(aggregate, repeat=3),
+           measure(streaming, repeat=3))
+    print('{:<40} {:10.1f} MB  {:10.1f} MB  (peak memory)'.format(
+        '', peak_memory(aggregate) / 2**20, peak_memory(streaming) / 2**20))
+
+
+SAMPLE_TEXT = (
+    'Farming in Flanders is large-scale and intensive. '
+    'Чому я не сокіл, чому не літаю? '
+    'Reģionālās attīstības un pašvaldību lietu ministrijas uzdevumā. '
+    'Dezvoltarea regională în România... Η ελληνική γλώσσα!!! ')
+
+
+def _make_regex():
+    """Reference: the former regex over the language maps."""
+    downcode_maps = textutils._make_mappings()
+    symbols = u"".join(downcode_maps.keys())
+    regex = re.compile(u"[%s]|[^%s]+" % (symbols, symbols))
+
+    return downcode_maps, regex
+
+
+def _downcode_regex(text, _cache={}):
+    """Reference: the former downcode, regex findall + concatenation."""
+    if not _cache:
+        _cache['maps'], _cache['regex'] = _make_regex()
+    downcoded = ''
+    for piece in _cache['regex'].findall(text):
+        downcoded += _cache['maps'].get(piece, piece)
+    return downcoded
+
+
+def bench_downcode():
+    print('regex downcode vs. translate table')
+    for size in (1, 4):
+        text = SAMPLE_TEXT * (size * 2**20 // len(SAMPLE_TEXT))
+        report('{} MB'.format(size),
+               measure(lambda: _downcode_regex(text), repeat=3),
+               measure(lambda: textutils.downcode(text), repeat=3))
+
+
+def _remove_nontext_scan(text):
+    """Reference: the former remove_nontext, a scan over a str alphabet."""
+    accepted = textutils._default_accepted()
+    result = ""
+    for piece in text:
+        if (piece in accepted) or (piece in [" ", "\n", "\r"]):
+            result += piece
+    return result
+
+
+def bench_remove_nontext():
+    print('alphabet scan vs. compiled regex')
+    text = (SAMPLE_TEXT + '→ ✓ ☺ 中文 ') * (2**20 // len(SAMPLE_TEXT))
+    report('1 MB',
+           measure(lambda: _remove_nontext_scan(text), repeat=1),
+           measure(lambda: textutils.remove_nontext(text), repeat=3))
+
+
+def _cleanup_hard_passes(text):
+    """Reference: the former TextCleaner.cleanup_hard, four passes."""
+    text = textutils.downcode(text)
+    text = textutils.RE_SPECIALSYMB.sub(' ', text)
+    text = textutils.RE_DIGITS.sub('', text)
+    text = textutils.RE_SPACES.sub(' ', text)
+    return text.strip()
+
+
+def _cleanup_concat(text):
+    """Reference: the former TextCleaner.cleanup, += over paragraphs."""
+    result = ''
+    for par in text.split('\n'):
+        par = par.strip()
+        if par == '':
+            continue
+        result += textutils.RE_SPACES.sub(' ', par) + '\n'
+    return result.strip()
+
+
+def bench_text_pipeline():
+    print('separate passes vs. compiled pipeline')
+    text = (SAMPLE_TEXT + ' 2020 \n\n  ') * (2**20 // len(SAMPLE_TEXT))
+    report('soft, 1 MB',
+           measure(lambda: _cleanup_concat(text), repeat=3),
+           measure(lambda: textutils.SOFT_CLEANUP(text), repeat=3))
+    report('hard, 1 MB',
+           measure(lambda: _cleanup_hard_passes(text), repeat=3),
+           measure(lambda: textutils.HARD_CLEANUP(text), repeat=3))
+
+
+def _extract_urls_alternation(text):
+    """Reference: the former TextCleaner.extract_urls."""
+    regex = re.compile(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+')
+    clean_urls = []
+    for url in regex.findall(text):
+        if bool(textutils.RE_AZ09.match(url[-1])):
+            url = url[:-1]
+        clean_urls.append(url)
+    return containers.distinct_elements(clean_urls, preserve_order=True)
+
+
+def bench_iter_urls():
+    print('in-memory alternation regex vs. streaming extractor')
+    line = ('Penguins took a stroll https://t.co/efBUX{} through '
+            'http://example.com/page/{}?q=1. the quiet streets.\n')
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'dump.txt')
+        with open(path, 'w') as fp:
+            for i in range(100000):
+                fp.write(line.format(i % 5000, i))
+
+        def baseline():
+            with open(path) as fp:
+                return _extract_urls_alternation(fp.read())
+
+        def candidate():
+            return list(textutils.iter_urls_file(path, distinct=True))
+
+        assert baseline() == candidate()
+        report('{:.0f} MB'.format(os.path.getsize(path) / 2**20),
+               measure(baseline, repeat=3), measure(candidate, repeat=3))
+        print('{:<40} {:10.1f} MB    {:10.1f} MB    (peak memory)'.format(
+            '', peak_memory(baseline) / 2**20, peak_memory(candidate) / 2**20))
+
+
+class _URLNormalizerEager:
+    """Reference: the former URLNormalizer."""
+    def __init__(self, url, **kwargs):
+        self.url = url
+        self._parsed = urllib.parse.urlparse(url)
+        self._uri = ''
+        self._domain = ''
+        self._domain_name = ''
+        if all([self._parsed.scheme, self._parsed.netloc, self._parsed.path]):
+            self._uri = url
+            self._domain = '{uri.scheme}://{uri.netloc}/'.format(uri=self._parsed)
+            self._domain_name = re.sub(r'.*w\.', '', self._parsed.netloc, 1)
+
+    @property
+    def ascii(self):
+        url = list(urllib.parse.urlsplit(self.url))
+        url[1] = url[1].encode('idna').decode("utf-8")
+        url[2] = urllib.parse.quote(url[2])
+        return urllib.parse.urlunsplit(url)
+
+
+def bench_normalize_urls():
+    print('URLNormalizer per url vs. normalize_urls (200k urls, 2k hosts)')
+    urls = ['https://www.host{}.com/page/{}?q=1'.format(i % 2000, i)
+            for i in range(200000)]
+
+    def baseline():
+        return [(x._uri, x._domain, x._domain_name)
+                for x in map(_URLNormalizerEager, urls)]
+
+    def candidate():
+        return list(textutils.normalize_urls(urls))
+
+    report('domains', measure(baseline, repeat=3), measure(candidate, repeat=3))
+    report('ascii', measure(lambda: [_URLNormalizerEager(x).ascii for x in urls], repeat=1),
+           measure(lambda: list(textutils.normalize_urls(urls, ascii=True)), repeat=1))
+    print('{:<40} {:10.1f} MB    {:10.1f} MB    (peak memory)'.format(
+        '', peak_memory(baseline) / 2**20, peak_memory(candidate) / 2**20))
+
+
+def bench_url_fingerprints():
+    print('set of url strings vs. URLFingerprintSet (200k urls)')
+    urls = ['https://www.host{}.com/section/article-{}.html'.format(i % 2000, i)
+            for i in range(200000)]
+    fingerprints = textutils.URLFingerprintSet(urls, canonical=False)
+    strings = set(urls)
+    print('{:<40} {:10.1f} MB    {:10.1f} MB    (retained memory)'.format(
+        '', allocated(lambda: set(urls)) / 2**20 + sum(map(sys.getsizeof, urls)) / 2**20,
+        allocated(lambda: textutils.URLFingerprintSet(urls, canonical=False)) / 2**20))
+    probe = urls[::2] + [url + '?x' for url in urls[::2]]
+    report('bulk membership',
+           measure(lambda: [url in strings for url in probe], repeat=3),
+           measure(lambda: fingerprints.contains_many(probe), repeat=3))
+
+
+def _smart_split_slicing(text, limit=100):
+    """Reference: the former smart_split, re-slicing the text."""
+    prefix = ""
+    while text:
+        chunk = text[:limit]
+        text = text[limit:]
+        if not any(chunk.endswith(x) for x in [" ", "\t", "\n"]):
+            try:
+                chunk, prefix = chunk.rsplit(maxsplit=1)
+            except ValueError:
+                pass
+            else:
+                text = prefix + text
+                if len(" ".join([chunk, text])) <= limit:
+                    chunk = " ".join([chunk, text])
+                    text = ""
+        yield chunk.strip()
+
+
+def bench_smart_split():
+    print('re-slicing vs. offset smart_split')
+    text = SAMPLE_TEXT * (2**20 // len(SAMPLE_TEXT))
+    report('1 MB',
+           measure(lambda: list(_smart_split_slicing(text)), repeat=1),
+           measure(lambda: list(textutils.smart_split(text)), repeat=3))
+
+
+def bench_smart_split_bytes():
+    print('decode + smart_split + encode vs. smart_split_bytes (4 MB)')
+    data = (SAMPLE_TEXT * (4 * 2**20 // len(SAMPLE_TEXT))).encode('utf-8')
+
+    def baseline():
+        text = data.decode('utf-8')
+        return [x.encode('utf-8')
+                for x in textutils.smart_split(text, 2**16, byte_limit=2**16)]
+
+    def candidate():
+        return list(textutils.smart_split_bytes(data, 2**16))
+
+    report('', measure(baseline, repeat=3), measure(candidate, repeat=3))
+    print('{:<40} {:10.1f} MB    {:10.1f} MB    (peak memory)'.format(
+        '', peak_memory(baseline) / 2**20, peak_memory(candidate) / 2**20))
+
+
+def _generate_key_hmac(*values, delimiter='_'):
+    """Reference: the former generate_key."""
+    import hmac, hashlib, uuid
+    if not values:
+        new_uuid = uuid.uuid4()
+    else:
+        new_uuid = delimiter.join([str(x) for x in values])
+    return hmac.new(str(new_uuid).encode('utf-8'),
+                    digestmod=hashlib.md5).hexdigest()
+
+
+def bench_generate_keys():
+    print('generate_key per record vs. generate_keys (100k records)')
+    rows = [('feed:twitter:tweet', 1251532472346652673 + i, -1)
+            for i in range(100000)]
+    report('hmac-md5',
+           measure(lambda: [_generate_key_hmac(*x) for x in rows], repeat=3),
+           measure(lambda: list(textutils.generate_keys(rows)), repeat=3))
+    report('blake2b/8',
+           measure(lambda: [_generate_key_hmac(*x) for x in rows], repeat=3),
+           measure(lambda: list(textutils.generate_keys(
+               rows, algorithm='blake2b', digest_size=8)), repeat=3))
+    report('random',
+           measure(lambda: [_generate_key_hmac() for x in rows], repeat=3),
+           measure(lambda: [textutils.generate_key() for x in rows], repeat=3))
+
+
+def _rand_string_choice(size=12):
+    """Reference: the former rand_string, random.choice per character."""
+    import random, string
+    return ''.join(random.choice(string.ascii_lowercase + string.digits)
+                   for x in range(size))
+
+
+def bench_generate_ids():
+    print('per-id functions vs. IDGenerator (100k ids)')
+    count = 100000
+    baseline = measure(lambda: [_rand_string_choice() for x in range(count)],
+                       repeat=3)
+    report('former rand_string', baseline,
+           measure(lambda: textutils.generate_ids(count), repeat=3))
+    report('rand_string', baseline,
+           measure(lambda: [textutils.rand_string() for x in range(count)],
+                   repeat=3))
+    generator = textutils.IDGenerator()
+    report('IDGenerator pool', baseline,
+           measure(lambda: [next(generator) for x in range(count)], repeat=3))
+    report('generate_key()',
+           measure(lambda: [_generate_key_hmac() for x in range(count)], repeat=3),
+           measure(lambda: textutils.generate_ids(
+               count, 26, textutils.BASE32_ALPHABET), repeat=3))
+    ulid = textutils.IDGenerator(16, textutils.BASE32_ALPHABET, ordered=True)
+    report('ordered (ULID-like)', baseline,
+           measure(lambda: [next(ulid) for x in range(count)], repeat=3))
+
+
+def _remove_repeated_punctuation_groupby(text):
+    """Reference: the former remove_repeated_punctuation."""
+    from itertools import groupby
+    from string import punctuation
+    result = []
+    for key, grouper in groupby(text):
+        if key in punctuation:
+            result.append(key)
+        else:
+            result.extend(grouper)
+    return ''.join(result)
+
+
+def bench_remove_repeated_punctuation():
+    print('groupby vs. compiled regex')
+    text = (SAMPLE_TEXT + 'What??! Really!!! ') * (2**20 // len(SAMPLE_TEXT))
+    baseline = measure(lambda: _remove_repeated_punctuation_groupby(text), repeat=3)
+    report('1 MB', baseline,
+           measure(lambda: textutils.remove_repeated_punctuation(text), repeat=3))
+    textutils.remove_repeated_punctuation('', unicode=True)
+    report('1 MB, unicode, keep ellipsis', baseline,
+           measure(lambda: textutils.remove_repeated_punctuation(
+               text, rules={'.': 3}, unicode=True), repeat=3))
+
+
+def _rescale_quadratic(data, maximum):
+    """Reference: the former calcs.rescale with integer `maximum`."""
+    import math
+    total = float(sum(data.values()))
+    scaled = [{'key': key, 'val': math.ceil(val / total * maximum)}
+              for key, val in data.items()]
+    scaled = sorted(scaled, key=lambda x: x['val'])
+    i = 0
+    while (sum(x['val'] for x in scaled) > maximum) and (i < len(scaled)):
+        scaled[i]['val'] = max(0, scaled[i]['val'] - 1)
+        i += 1
+    return dict((x['key'], x['val']) for x in scaled)
+
+
+def bench_rescale():
+    print('former rescale vs. rescale / rescale_many (1000 x 200 bins)')
+    import random
+    from utils import calcs
+    rows = [[random.randint(0, 1000) for _ in range(200)] for _ in range(1000)]
+    histograms = [dict(enumerate(row)) for row in rows]
+    baseline = measure(
+        lambda: [_rescale_quadratic(x, 1000) for x in histograms], repeat=1)
+    report('ceil', baseline, measure(
+        lambda: [calcs.rescale(x, 1000) for x in histograms], repeat=3))
+    report('largest_remainder', baseline, measure(
+        lambda: [calcs.rescale(x, 1000, 'largest_remainder')
+                 for x in histograms], repeat=3))
+    if calcs.numpy is not None:
+        report('rescale_many', baseline,
+               measure(lambda: calcs.rescale_many(rows, 1000), repeat=3))
+
+
+def bench_streaming_stats():
+    print('collected list + sort vs. RunningStats + QuantileSketch (1M)')
+    import random
+    from utils import calcs
+    samples = [random.lognormvariate(3, 1) for _ in range(1000000)]
+
+    def baseline():
+        collected = list(samples)
+        collected.sort()
+        mean = sum(collected) / len(collected)
+        return mean, [collected[int(q * (len(collected) - 1))]
+                      for q in (.5, .95, .99)]
+
+    def streaming():
+        stats, sketch = calcs.RunningStats(), calcs.QuantileSketch()
+        for chunk in range(0, len(samples), 10000):
+            stats.update(samples[chunk:chunk + 10000])
+            sketch.update(samples[chunk:chunk + 10000])
+        return stats.mean, sketch.quantiles([.5, .95, .99])
+
+    report('chunks of 10k', measure(baseline, repeat=3),
+           measure(streaming, repeat=3))
+    print('{:<40} {:10.1f} MB    {:10.1f} MB    (peak memory)'.format(
+        '', peak_memory(baseline) / 2**20, peak_memory(streaming) / 2**20))
+    print('{:<40} {} {}'.format('', baseline()[1], streaming()[1]))
+
+
+def bench_bucketize():
+    print('per-event loop vs. bucketize')
+    import numpy
+    from utils import datetimeutils
+    start = datetime.datetime(2020, 4, 18, 1, 5)
+    end = datetime.datetime(2020, 4, 18, 20, 50)
+    first = datetimeutils.datetime_to_timestamp(start)
+    last = datetimeutils.datetime_to_timestamp(end)
+
+    def loop(timestamps):
+        interval, bucket, end_ = datetimeutils.round_datetime_interval(start, end)
+        counts = [0] * ((end_ - bucket) // interval)
+        for timestamp in timestamps:
+            index = (timestamp - bucket) // interval
+            if 0 <= index < len(counts):
+                counts[index] += 1
+        return counts
+
+    events = numpy.random.randint(first, last, 1000000, dtype=numpy.int64)
+    as_list = events.tolist()
+    report('1M events', measure(lambda: loop(as_list), repeat=3),
+           measure(lambda: datetimeutils.bucketize(events, start, end), repeat=3))
+    events = numpy.random.randint(first, last, 50000000, dtype=numpy.int64)
+    print('{:<40} {:10.3f} ms (bucketize only)'.format(
+        '50M events',
+        measure(lambda: datetimeutils.bucketize(events, start, end), repeat=3) * 1000))
+
+
+BENCHMARKS = [
+    bench_lazy_recorddict,
+    bench_lookup,
+    bench_record_batch,
+    bench_flatten,
+    bench_serialize,
+    bench_ndjson,
+    bench_deep_merge,
+    bench_normalize_keys,
+    bench_top_occurences,
+    bench_count_distinct,
+    bench_group_by,
+    bench_downcode,
+    bench_remove_nontext,
+    bench_text_pipeline,
+    bench_iter_urls,
+    bench_normalize_urls,
+    bench_url_fingerprints,
+    bench_smart_split,
+    bench_smart_split_bytes,
+    bench_generate_keys,
+    bench_generate_ids,
+    bench_remove_repeated_punctuation,
+    bench_rescale,
+    bench_streaming_stats,
+    bench_bucketize,
+]
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:]
+    for bench in BENCHMARKS:
+        if not names or any(name in bench.__name__ for name in names):
+            bench()
+            print()
@@ -1,11 +1,26 @@
 # -*- coding: utf-8 -*-
 
 import unittest
+from unittest import mock
 import datetime
+import tempfile
+import decimal
+import uuid
+import json
+import io
+import mmap
+import time
+import random
+import hmac
+import hashlib
+import os
 
 from utils import containers
 from utils import textutils
 from utils import calcs
+from utils import cmd
+from utils import compat
+from utils import datetimeutils
 import decorators
 
 
@@ -84,6 +99,13 @@ class TestUtilsRecordDictMethods(unittest.TestCase):
         with self.assertRaises(KeyError):
             obj["place_location_lon"]
 
+    def test__unflatten(self):
+        obj = containers.RecordDict(**self.text_dict)
+        obj.flatten(separator=".")
+        obj.unflatten(separator=".")
+        self.assertEqual(obj, self.text_dict)
+        self.assertEqual(obj.place.location.lat, 50.640991)
+
     def test__update(self):
         test_dict = {
             "name": "Ministry of Silly Walks",
@@ -97,6 +119,21 @@ class TestUtilsRecordDictMethods(unittest.TestCase):
         self.assertEqual(obj["name"], "Ministry of Silly Walks")
         self.assertEqual(obj.place.location.lon, 12.5)
 
+    def test__merge(self):
+        obj = containers.RecordDict(**self.text_dict)
+        merged = obj.merge({"place": {"location": {"lon": 12.5}}},
+                           {"place": {"name": "Czechia"}, "x": {"y": 1}})
+        self.assertTrue(isinstance(merged, containers.RecordDict))
+        self.assertEqual(merged.place.location.lon, 12.5)
+        self.assertEqual(merged.place.location.lat, 50.640991)
+        self.assertEqual(merged.place.name, "Czechia")
+        self.assertEqual(merged.x.y, 1)
+        self.assertEqual(obj.place.location.lon, 4.66092)
+        self.assertEqual(obj.place.name, "Belgium")
+        self.assertIs(merged.lang, obj.lang)
+        self.assertEqual(obj.copy(), obj)
+        self.assertTrue(isinstance(obj.copy(), containers.RecordDict))
+
     def test__lookup(self):
         obj = containers.RecordDict(**self.text_dict)
         self.assertEqual(obj.lookup("name"), "Report Summaries Departement")
@@ -104,6 +141,24 @@ class TestUtilsRecordDictMethods(unittest.TestCase):
         self.assertEqual(obj.lookup("lang/name", delimiter="/"), "English")
         paths = ["place.location.xyz", "gorgonzola", "place.belongsto", "wu"]
         self.assertEqual(obj.lookup(*paths), ["Europe"])
+        self.assertEqual(obj.lookup("place.name.xyz", default=-1), -1)
+        self.assertIs(containers.compile_path("place.location.lat"),
+                      containers.compile_path("place.location.lat"))
+
+    def test__set_path(self):
+        obj = containers.RecordDict(**self.text_dict)
+        obj.set_path("place.location.lon", 12.5)
+        obj.set_path("lang/pl/label", "Polish", delimiter="/")
+        self.assertEqual(obj.place.location.lon, 12.5)
+        self.assertEqual(obj.lang.pl.label, "Polish")
+        self.assertTrue(isinstance(obj.lang.pl, containers.RecordDict))
+
+    def test__delete_path(self):
+        obj = containers.RecordDict(**self.text_dict)
+        obj.delete_path("place.location.lon")
+        self.assertEqual(obj.place.location, {"lat": 50.640991})
+        with self.assertRaises(KeyError):
+            obj.delete_path("place.location.xyz")
 
     def test__from_list(self):
         obj = containers.RecordDict.from_list(
@@ -142,6 +197,173 @@ class TestUtilsRecordDictMethods(unittest.TestCase):
         with self.assertRaises(KeyError):
             obj["gpe"]
 
+    def test__group_by(self):
+        records = [
+            {"label": "GPE", "text": "Philippines", "score": {"conf": .9}, "lang": "en"},
+            {"label": "GPE", "text": "Nigeria", "score": {"conf": .7}, "lang": "en"},
+            {"label": "GPE", "text": "Nigeria", "lang": "fi"},
+            {"label": "ORG", "text": "FSC", "score": {"conf": .8}, "lang": "en"},
+        ]
+        obj = containers.RecordDict.group_by(iter(records), "label", {
+            "n": "count",
+            "conf": ("mean", "score.conf"),
+            "top": ("max", "score.conf"),
+            "first": ("first", "text"),
+            "last": ("last", "text"),
+            "texts": ("distinct", "text"),
+            "all_texts": ("collect", "text")})
+        self.assertEqual(obj.GPE, {
+            "n": 3, "conf": .8, "top": .9, "first": "Philippines",
+            "last": "Nigeria", "texts": ["Philippines", "Nigeria"],
+            "all_texts": ["Philippines", "Nigeria", "Nigeria"]})
+        self.assertEqual(obj.ORG.n, 1)
+        self.assertEqual(obj.ORG.texts, ["FSC"])
+
+        obj = containers.group_by(records, ["lang", "label"],
+                                  {"n": "count", "low": ("min", "score.conf")})
+        self.assertEqual(obj, {
+            "en": {"GPE": {"n": 2, "low": .7}, "ORG": {"n": 1, "low": .8}},
+            "fi": {"GPE": {"n": 1, "low": None}}})
+        self.assertEqual(obj.en.GPE.n, 2)
+
+        self.assertEqual(containers.group_by(records, "score/conf",
+                                             {"total": ("sum", "text/xyz")},
+                                             delimiter="/"),
+                         {.9: {"total": 0}, .7: {"total": 0},
+                          None: {"total": 0}, .8: {"total": 0}})
+        with self.assertRaises(ValueError):
+            containers.group_by(records, "label", {"n": "median"})
+        self.assertEqual(containers.group_by(records, "lang").fi.count, 1)
+
+    def test__lazy(self):
+        obj = containers.LazyRecordDict(**self.text_dict)
+        self.assertFalse(isinstance(dict.__getitem__(obj, "place"),
+                                    containers.RecordDict))
+        self.assertEqual(obj.place.location.lat, 50.640991)
+        self.assertTrue(isinstance(dict.__getitem__(obj, "place"),
+                                   containers.LazyRecordDict))
+        self.assertIs(obj.place, obj["place"])
+        self.assertEqual(obj, containers.RecordDict(**self.text_dict))
+        self.assertEqual(obj.lookup("lang/name", delimiter="/"), "English")
+        with self.assertRaises(AttributeError):
+            obj.gorgonzola
+
+        obj = containers.LazyRecordDict(**{"geo": [{"gpe": "Turkey"}, ("ORG",)]})
+        self.assertEqual(obj.geo[0].gpe, "Turkey")
+        self.assertEqual(obj.geo[1], ["ORG"])
+
+        obj = containers.LazyRecordDict(**self.text_dict)
+        obj.update({"place": {"location": {"lon": 12.5}}, "x": {"y": 1}})
+        self.assertEqual(obj.place.location.lon, 12.5)
+        self.assertEqual(obj.place.location.lat, 50.640991)
+        self.assertEqual(obj.x.y, 1)
+
+        obj = containers.LazyRecordDict(**self.text_dict)
+        obj.flatten()
+        self.assertEqual(obj.place_location_lat, 50.640991)
+
+    def test__lazy__as_recorddict(self):
+        # Keys named like methods are reachable as attributes in both.
+        data = {"items": 5, "keys": {"a": 1}, "get": [{"b": 2}], "copy": 0}
+        eager = containers.RecordDict(**data)
+        lazy = containers.LazyRecordDict(**data)
+        for key in data:
+            self.assertEqual(getattr(lazy, key), getattr(eager, key))
+        self.assertTrue(isinstance(lazy.keys, containers.LazyRecordDict))
+        self.assertEqual(lazy.get[0].b, 2)
+
+        lazy = containers.LazyRecordDict(**self.text_dict)
+        values, items = lazy.values(), lazy.items()
+        self.assertEqual(len(values), len(self.text_dict))
+        self.assertTrue(all(not isinstance(val, dict)
+                            or isinstance(val, containers.LazyRecordDict)
+                            for val in values))
+        self.assertIn(("place", lazy.place), items)
+        self.assertEqual(dict(items), containers.RecordDict(**self.text_dict))
+        lazy.extra = 1
+        self.assertIn(1, values)
+        self.assertEqual(list(reversed(items))[0], ("extra", 1))
+
+
+class TestUtilsRecordBatchMethods(unittest.TestCase):
+    records = [
+        {"element": "akash", "consort": {"id": "Bhumi", "rank": 1, "w": .5}},
+        {"element": "vayu", "consort": {"id": "Lehari", "rank": 2, "w": 1}},
+        {"element": "agni", "consort": {"id": "Swaha", "rank": 3, "w": 2.5}},
+        {"element": "bhumi", "consort": {"id": "Dyaus", "rank": 4}},
+    ]
+
+    def test__from_records(self):
+        batch = containers.RecordBatch.from_records(self.records)
+        self.assertEqual(len(batch), 4)
+        self.assertEqual(batch.keys(),
+                         ["element", "consort.id", "consort.rank", "consort.w"])
+        self.assertTrue(isinstance(batch._columns["consort.rank"],
+                                   containers.array))
+        # A sparse numeric column stays packed, with a mask of gaps.
+        self.assertTrue(isinstance(batch._columns["consort.w"],
+                                   containers.array))
+        self.assertEqual(list(batch._masks["consort.w"]), [0, 0, 0, 1])
+        self.assertIsNone(batch.mask("consort.rank"))
+        self.assertEqual(batch[2].consort.w, 2.5)
+        self.assertEqual(batch[1].consort.id, "Lehari")
+        self.assertEqual(batch[-1]["consort"]["rank"], 4)
+        with self.assertRaises(AttributeError):
+            batch[3].consort.w
+        with self.assertRaises(IndexError):
+            batch[4]
+
+    def test__to_records(self):
+        batch = containers.RecordBatch.from_records(self.records)
+        self.assertEqual(batch.to_records(), self.records)
+        self.assertEqual(batch[0].consort.to_record(), self.records[0]["consort"])
+        self.assertEqual([row for row in batch], self.records)
+        obj = containers.RecordDict(**TEXT_DICT)
+        batch = containers.RecordBatch.from_records([obj])
+        self.assertEqual(batch.to_records()[0].place.location.lat, 50.640991)
+
+    def test__select(self):
+        batch = containers.RecordBatch.from_records(self.records)
+        selected = batch.select([True, False, True, False])
+        self.assertEqual(selected.to_records(), self.records[0:3:2])
+        self.assertEqual(batch.select([3]).to_records(), self.records[3:])
+        self.assertEqual(batch.select([]).to_records(), [])
+        self.assertEqual(batch.select(iter([2, 0])).to_records(),
+                         [self.records[2], self.records[0]])
+
+    @unittest.skipUnless(containers.numpy, "requires numpy")
+    def test__column(self):
+        batch = containers.RecordBatch.from_records(self.records)
+        ranks = batch.column("consort.rank")
+        self.assertEqual(ranks.sum(), 10)
+        batch.set_column("consort.score", ranks * 1.5)
+        self.assertEqual(batch[1].consort.score, 3.)
+        selected = batch.select(batch.column("consort.rank") > 2)
+        self.assertEqual([x.element for x in selected], ["agni", "bhumi"])
+        with self.assertRaises(ValueError):
+            batch.set_column("x", [1, 2])
+
+        weights = batch.column("consort.w")
+        self.assertEqual(batch.mask("consort.w").tolist(), [False, False, False, True])
+        self.assertEqual(containers.numpy.nansum(weights), 4.)
+        self.assertIsNone(batch.select([0, 1]).mask("consort.w"))
+        self.assertEqual(batch.select([3, 0]).mask("consort.w").tolist(), [True, False])
+        batch.set_column("consort.w", [1., 2., 3., 4.])
+        self.assertIsNone(batch.mask("consort.w"))
+
+    @unittest.skipUnless(containers.numpy, "requires numpy")
+    def test__save_load(self):
+        batch = containers.RecordBatch.from_records(self.records)
+        with tempfile.TemporaryDirectory() as path:
+            batch.save(path)
+            loaded = containers.RecordBatch.load(path)
+            self.assertTrue(isinstance(loaded._columns["consort.rank"],
+                                       containers.numpy.memmap))
+            self.assertEqual(loaded.to_records(), self.records)
+            self.assertEqual(loaded.column("consort.rank").max(), 4)
+            self.assertEqual(loaded.mask("consort.w").tolist(),
+                             [False, False, False, True])
+
 
 class TestUtilsFunctions(unittest.TestCase):
     text_dict = TEXT_DICT.copy()
@@ -156,6 +378,78 @@ class TestUtilsFunctions(unittest.TestCase):
         self.assertEqual(test_dict["name"], self.text_dict["name"])
         self.assertEqual(test_dict["place"]["location"]["lon"], 4.66092)
 
+    def test__deep_merge(self):
+        base = {"db": {"host": "localhost", "port": 5432}, "debug": False,
+                "cache": {"ttl": 60}}
+        override = {"db": {"port": 6432, "opts": {"ssl": True}}}
+        merged = containers.deep_merge(base, override, {"debug": True},
+                                       {"db": {"opts": {"timeout": 5}}})
+        self.assertEqual(merged, {
+            "db": {"host": "localhost", "port": 6432,
+                   "opts": {"ssl": True, "timeout": 5}},
+            "debug": True,
+            "cache": {"ttl": 60}})
+        self.assertEqual(base, {"db": {"host": "localhost", "port": 5432},
+                                "debug": False, "cache": {"ttl": 60}})
+        self.assertEqual(override, {"db": {"port": 6432, "opts": {"ssl": True}}})
+        self.assertIs(merged["cache"], base["cache"])
+        self.assertEqual(containers.deep_merge(base), base)
+        self.assertIsNot(containers.deep_merge(base), base)
+
+    def test__lookup_many(self):
+        records = [
+            self.text_dict,
+            {"name": "Ministry of Silly Walks", "lang": {"label": "fi"}},
+        ]
+        self.assertEqual(
+            containers.lookup_many(records, "lang.label", "place.name"),
+            {"lang.label": ["en", "fi"], "place.name": ["Belgium", None]}
+            )
+        self.assertEqual(
+            containers.lookup_many(iter(records), "place/id",
+                                   default="", delimiter="/"),
+            {"place/id": ["85632997", ""]}
+            )
+
+    def test__flatten_dict(self):
+        flat = containers.flatten_dict(self.text_dict, separator=".")
+        self.assertEqual(list(flat.items()),
+                         list(containers.iter_flatten(self.text_dict,
+                                                      separator=".")))
+        self.assertEqual(flat["place.location.lat"], 50.640991)
+        self.assertEqual(containers.unflatten(flat, separator="."),
+                         self.text_dict)
+
+        deep = leaf = {}
+        for _ in range(5000):
+            leaf["x"] = {}
+            leaf = leaf["x"]
+        leaf["y"] = 1
+        flat = containers.flatten_dict(deep, separator="/")
+        self.assertEqual(flat, {"x/" * 5000 + "y": 1})
+
+        with self.assertRaises(ValueError):
+            containers.unflatten({"a": 1, "a_b": 2})
+        with self.assertRaises(ValueError):
+            containers.unflatten({"a_b": 2, "a": 1})
+
+    def test__flatten_many(self):
+        records = [self.text_dict, {"lang": {"label": "fi"}}]
+        flat = list(containers.flatten_many(records))
+        self.assertEqual(flat, [containers.flatten_dict(rec) for rec in records])
+        self.assertIs(list(flat[0])[1], list(flat[1])[0])
+
+        # 1 and True are equal keys, but are formatted differently.
+        records = [{"a": {1: "x"}}, {"a": {True: "y"}}, {1: {"b": 0}}, {True: {"b": 1}}]
+        self.assertEqual(list(containers.flatten_many(records)),
+                         [containers.flatten_dict(rec) for rec in records])
+
+        # The cache is bounded; results don't depend on it.
+        records = [{"id": {str(i): {"x": i}}} for i in range(10)]
+        with mock.patch.object(containers, "FLATTEN_CACHE_SIZE", 3):
+            self.assertEqual(list(containers.flatten_many(records)),
+                             [containers.flatten_dict(rec) for rec in records])
+
     def test__flatten_list(self):
         self.assertEqual(
             containers.flatten_list([['Sonic'], ['Youth']]),
@@ -211,6 +505,19 @@ class TestUtilsFunctions(unittest.TestCase):
         self.assertTrue("TimeZone" in output_customized["LastModified"])
         self.assertTrue(input_ == output_intact)
 
+        input_ = {"Set-Cookie": [{"Max-Age": 60}, [{"Http-Only": True}], "x"]}
+        self.assertEqual(containers.normalize_keys(input_), {
+            "set_cookie": [{"max_age": 60}, [{"http_only": True}], "x"]})
+
+    def test__normalize_keys_many(self):
+        records = [{"Content-Type": "text/html"}] * 10
+        containers.normalize_key.cache_clear()
+        output = list(containers.normalize_keys_many(iter(records)))
+        self.assertEqual(output, [{"content_type": "text/html"}] * 10)
+        stats = containers.normalize_keys_cache_info()
+        self.assertEqual((stats.hits, stats.misses, stats.size), (9, 1, 1))
+        self.assertEqual(stats.hit_rate, .9)
+
     def test__compress_and_sort_by_occurence(self):
         names = ['Siddhartha', 'Varuna', 'Daruma', 'Siddhartha', 'Daruma', 'Kevala', 'Siddhartha']
 
@@ -234,6 +541,46 @@ class TestUtilsFunctions(unittest.TestCase):
                                     {'elm': 'Siddhartha', 'num': 3}])
         self.assertTrue(all(x['num'] == 1 for x in res[:2]))
 
+    def test__top_occurences(self):
+        names = ['Siddhartha', 'Varuna', 'Daruma', 'Siddhartha', 'Daruma', 'Kevala', 'Siddhartha']
+        self.assertEqual(containers.top_occurences(names, limit=2),
+                         ['Siddhartha', 'Daruma'])
+        self.assertEqual(containers.top_occurences(names, 1, values_only=False),
+                         [{'elm': 'Siddhartha', 'num': 3}])
+        self.assertEqual(containers.top_occurences(names, 2, exact=True),
+                         ['Siddhartha', 'Daruma'])
+
+    def test__TopK(self):
+        stream = []
+        for i in range(1, 2001):
+            stream.extend(['topic_{}'.format(i)] * (1 if i > 5 else 200 * i))
+        counter = containers.TopK(capacity=50)
+        counter.update(stream)
+        self.assertEqual(len(counter), 50)
+        self.assertEqual(counter.total, len(stream))
+        self.assertEqual([x for x, _ in counter.most_common(5)],
+                         ['topic_{}'.format(i) for i in range(5, 0, -1)])
+        for elm, num in counter.most_common(5):
+            self.assertTrue(num - counter.error(elm) <= stream.count(elm) <= num)
+            self.assertTrue(counter.error(elm) <= counter.error_bound)
+
+        counter = containers.TopK(capacity=3)
+        counter.update({'covid': 5, 'flood': 2})
+        counter.add(1, weight=3)
+        self.assertEqual(counter.most_common(), [('covid', 5), (1, 3), ('flood', 2)])
+        with self.assertRaises(ValueError):
+            counter.add('x', weight=0)
+
+        left, right = containers.TopK(capacity=50), containers.TopK(capacity=50)
+        left.update(stream[::2])
+        right.update(stream[1::2])
+        merged = left.merge(right)
+        self.assertEqual(merged.total, len(stream))
+        self.assertEqual([x for x, _ in merged.most_common(5)],
+                         ['topic_{}'.format(i) for i in range(5, 0, -1)])
+        for elm, num in merged.most_common(5):
+            self.assertTrue(num - merged.error(elm) <= stream.count(elm) <= num)
+
     def test__prepare_to_serialize(self):
         dict_ = {
             'x': 12,
@@ -262,6 +609,48 @@ class TestUtilsFunctions(unittest.TestCase):
                 ]
             })
 
+        safe = {'t': (1, 2), 'l': [(3, 'a')]}
+        self.assertIs(containers.prepare_to_serialize(safe), safe)
+        self.assertEqual(safe, {'t': (1, 2), 'l': [(3, 'a')]})
+
+    def test__to_json(self):
+        dict_ = {
+            'when': datetime.date(2020, 4, 18),
+            'price': decimal.Decimal('1.50'),
+            'id': uuid.UUID('5feb7d8b-4a0e-441a-64bb-2e83a83c5839'),
+            'tags': {'GPE'},
+            'raw': b'\x00\xff',
+            't': (1, [datetime.datetime(2020, 4, 18, 20, 36, 43)]),
+        }
+        expected = {
+            'when': '2020-04-18',
+            'price': '1.50',
+            'id': '5feb7d8b-4a0e-441a-64bb-2e83a83c5839',
+            'tags': ['GPE'],
+            'raw': 'AP8=',
+            't': [1, ['2020-04-18T20:36:43']],
+        }
+        self.assertEqual(json.loads(containers.to_json(dict_)), expected)
+
+        stream = io.StringIO()
+        containers.to_json(dict_, stream, sort_keys=True)
+        self.assertEqual(json.loads(stream.getvalue()), expected)
+        self.assertEqual(containers.prepare_to_serialize(dict(dict_)), expected)
+
+        class Point:
+            def __init__(self, x, y):
+                self.x, self.y = x, y
+
+        containers.register_json_serializer(Point, lambda p: [p.x, p.y])
+        try:
+            self.assertEqual(containers.to_json({'p': Point(1, 2)}),
+                             '{"p": [1, 2]}')
+            self.assertEqual(
+                containers.prepare_to_serialize({'p': {Point(3, 4)}}),
+                {'p': [[3, 4]]})
+        finally:
+            del containers.JSON_SERIALIZERS[Point]
+
     def test__distinct(self):
         in_ = [11, 12, 18, 11, 18, 12, 22]
         out_ = containers.distinct_elements(in_, preserve_order=True)
@@ -272,6 +661,43 @@ class TestUtilsFunctions(unittest.TestCase):
         self.assertEqual(out_, ['Sæwine', 'Pipra', 'Patrick', 'Rasa', 'Nermin', 'Seren'])
 
 
+    def test__count_distinct(self):
+        in_ = ['Sæwine', 'Sæwine', 'Pipra', 'Patrick', 'Pipra', 'Rasa']
+        self.assertEqual(containers.count_distinct(in_), 4)
+        self.assertEqual(containers.count_distinct(iter(in_), approx=False), 4)
+
+        urls = ['https://example.com/{}'.format(i % 30000) for i in range(60000)]
+        estimate = containers.count_distinct(urls)
+        self.assertTrue(abs(estimate - 30000) / 30000 < .03)
+
+    def test__HyperLogLog(self):
+        self.assertEqual(containers.hash64('Sæwine'), containers.hash64('Sæwine'))
+        self.assertNotEqual(containers.hash64(1), containers.hash64('1'))
+        self.assertEqual(containers.hash64(('a', 1, None)),
+                         containers.hash64(('a', 1, None)))
+        self.assertRaises(TypeError, containers.hash64, object())
+        self.assertRaises(TypeError, containers.hash64, ('a', frozenset('b')))
+        self.assertNotEqual(containers.hash64('a'), containers.hash64(b'a'))
+        self.assertEqual(len(set(map(containers.hash64, [1, 1.0, True]))), 1)
+        self.assertEqual(containers.hash64((1, 'a')), containers.hash64((1.0, 'a')))
+        self.assertEqual(containers.count_distinct([1, 1.0, True, 2]),
+                         containers.count_distinct([1, 1.0, True, 2], approx=False))
+
+        left, right = containers.HyperLogLog(12), containers.HyperLogLog(12)
+        self.assertEqual(len(left.registers), 4096)
+        left.update(range(20000))
+        right.update(range(10000, 30000))
+        restored = containers.HyperLogLog.from_bytes(right.to_bytes())
+        self.assertEqual(restored, right)
+        left.merge(restored)
+        self.assertTrue(abs(len(left) - 30000) / 30000 < .05)
+
+        with self.assertRaises(ValueError):
+            left.merge(containers.HyperLogLog(10))
+        with self.assertRaises(ValueError):
+            containers.HyperLogLog(2)
+
+
 class TestTextUtils(unittest.TestCase):
     def test__rand_string(self):
         self.assertEqual(len(textutils.rand_string()), 12)
@@ -282,12 +708,77 @@ class TestTextUtils(unittest.TestCase):
         with self.assertRaises(TypeError):
             textutils.rand_string(0.99999)
 
+    def test__IDGenerator(self):
+        ids = textutils.generate_ids(10000)
+        self.assertEqual(len(set(ids)), 10000)
+        self.assertTrue(all(len(x) == 12 for x in ids))
+        self.assertEqual(set(''.join(ids)), set(textutils.BASE36_ALPHABET))
+
+        generator = textutils.IDGenerator(4, 'xyz', pool_size=3)
+        ids = [next(generator) for _ in range(10)] + generator.take(5)
+        self.assertTrue(all(len(x) == 4 and set(x) <= set('xyz') for x in ids))
+
+        generator = textutils.IDGenerator(16, textutils.BASE32_ALPHABET,
+                                          ordered=True)
+        first = next(generator)
+        time.sleep(0.002)
+        later = generator.take(3)
+        self.assertEqual(len(first), 26)
+        self.assertLess(first, min(later))
+        self.assertEqual(len({x[:10] for x in later}), 1)
+
+        self.assertRaises(ValueError, textutils.IDGenerator, 8, 'aab')
+        self.assertRaises(ValueError, textutils.IDGenerator, 8, 'ba', ordered=True)
+
     def test__generate_key(self):
         keys = ('feed:twitter:tweet', 1251532472346652673, -1)
         self.assertEqual(
             textutils.generate_key(*keys),
             '5feb7d8b4a0e441a64bb2e83a83c5839'
             )
+        self.assertEqual(
+            list(textutils.generate_keys([keys, 'feed'])),
+            ['5feb7d8b4a0e441a64bb2e83a83c5839', textutils.generate_key('feed')])
+        self.assertEqual(len(textutils.generate_key()), 32)
+        for key in (b'', b'k', b'x' * 64, 'Сокіл'.encode('utf-8') * 20):
+            self.assertEqual(textutils._hmac_md5(key),
+                             hmac.new(key, digestmod=hashlib.md5).hexdigest())
+        self.assertNotEqual(textutils.generate_key(), textutils.generate_key())
+        self.assertEqual(
+            textutils.generate_key(*keys, algorithm='blake2b', digest_size=8),
+            next(textutils.generate_keys([keys], algorithm='blake2b',
+                                         digest_size=8)))
+        self.assertEqual(len(textutils.generate_key(*keys, algorithm='sha1')), 40)
+        self.assertRaises(ValueError, textutils.generate_key, 1, algorithm='nohash')
+        self.assertEqual(len(textutils.generate_key(algorithm='sha1')), 40)
+        self.assertEqual(
+            len(textutils.generate_key(algorithm='blake2b', digest_size=8)), 16)
+        self.assertRaises(ValueError, textutils.generate_key, algorithm='nohash')
+        self.assertRaises(ValueError, textutils.generate_key, 1,
+                          algorithm='shake_128')
+
+    def test__content_key(self):
+        record = {'id': 1, 'tags': {'b', 'a'},
+                  'created': datetime.date(2020, 4, 18), 'title': 'Сокіл'}
+        key = textutils.content_key(record)
+        self.assertEqual(key, '92740b2fdf7af68504a4ace560909d7b')
+        self.assertEqual(
+            textutils.content_key(containers.RecordDict(
+                title='Сокіл', created=datetime.date(2020, 4, 18),
+                tags={'a', 'b'}, id=1)),
+            key)
+        self.assertNotEqual(textutils.content_key(dict(record, id=2)), key)
+        self.assertEqual(
+            list(textutils.content_keys([record, record], algorithm='md5')),
+            [textutils.content_key(record, algorithm='md5')] * 2)
+
+        # No `str` fallback: it could contain a memory address.
+        class Tag:
+            pass
+        self.assertRaises(TypeError, textutils.content_key, {'a': Tag()})
+        self.assertRaises(TypeError, textutils.content_key, {'a': [{Tag()}]})
+        self.assertEqual(textutils.content_key({'a': uuid.UUID(int=1)}),
+                         textutils.content_key({'a': str(uuid.UUID(int=1))}))
 
     def test__remove_repeated_punctuation(self):
         text = 'Impacts of demographic change on public expenditure.........'
@@ -308,6 +799,26 @@ class TestTextUtils(unittest.TestCase):
             'Is it raining? No but., it is snowing!#!@#@'
             )
 
+        self.assertEqual(
+            textutils.remove_repeated_punctuation(text, rules={'.': 3, '#': 2}),
+            'Is it raining? No but..., it is snowing!##!@#@'
+            )
+        text = 'Чекай…… «««ні»»» — так!!!'
+        self.assertEqual(textutils.remove_repeated_punctuation(text),
+                         'Чекай…… «««ні»»» — так!')
+        self.assertEqual(
+            textutils.remove_repeated_punctuation(text, unicode=True),
+            'Чекай… «ні» — так!')
+        self.assertEqual(
+            list(textutils.remove_repeated_punctuation_many(
+                ['Wait....', 'What??'], rules={'.': 3})),
+            ['Wait...', 'What?'])
+        self.assertEqual(
+            textutils.TextPipeline('remove_repeated_punctuation', 'strip')(' Hi!!! '),
+            'Hi!')
+        self.assertRaises(ValueError, textutils.remove_repeated_punctuation,
+                          text, {'..': 1})
+
     def test__smart_truncate(self):
         text = "Let us know if you find this package useful."
         self.assertEqual(textutils.smart_truncate(text), text)
@@ -343,6 +854,46 @@ class TestTextUtils(unittest.TestCase):
         ])
         self.assertTrue(all(len(x) <= 100 for x in textutils.smart_split(text)))
 
+        self.assertEqual(
+            list(textutils.smart_split_file(io.StringIO(text), limit=50,
+                                            buffer_size=7)),
+            list(textutils.smart_split(text, limit=50)))
+
+        text = "Чому я не сокіл, чому не літаю? " * 10
+        chunks = list(textutils.smart_split(text, limit=50, byte_limit=40))
+        self.assertEqual(chunks[0], "Чому я не сокіл, чому")
+        self.assertTrue(all(len(x.encode('utf-8')) <= 40 for x in chunks))
+        self.assertEqual(" ".join(chunks), text.strip())
+
+    def test__smart_split_bytes(self):
+        data = "Чому я не сокіл,\nчому не літаю?".encode('utf-8')
+        chunks = list(textutils.smart_split_bytes(data, limit=20))
+        self.assertTrue(all(isinstance(x, memoryview) for x in chunks))
+        self.assertEqual([bytes(x).decode('utf-8') for x in chunks],
+                         ["Чому я не ", "сокіл,\n", "чому не ", "літаю?"])
+        self.assertEqual(b''.join(chunks), data)
+
+        # No whitespace: cut at character boundaries.
+        chunks = textutils.smart_split_bytes(bytearray("літаю" * 3, 'utf-8'), 9)
+        self.assertEqual([bytes(x).decode('utf-8') for x in chunks],
+                         ["літа", "юліт", "аюлі", "таю"])
+
+        with tempfile.TemporaryFile() as fp:
+            fp.write(data)
+            fp.flush()
+            with mmap.mmap(fp.fileno(), 0) as buffer:
+                chunks = list(textutils.smart_split_bytes(buffer, limit=20))
+                self.assertEqual(b''.join(chunks), data)
+                del chunks
+
+        self.assertRaises(ValueError, next, textutils.smart_split_bytes(data, 3))
+
+        # Invalid UTF-8 (a run of continuation bytes) must still terminate.
+        data = b'a' + b'\x80' * 10
+        chunks = list(textutils.smart_split_bytes(data, 4))
+        self.assertEqual(b''.join(chunks), data)
+        self.assertTrue(all(0 < len(x) <= 4 for x in chunks))
+
     def test__downcode(self):
         text = "Farming in Flanders is large-scale and intensive:"
         self.assertEqual(textutils.downcode(text), text)
@@ -357,6 +908,19 @@ class TestTextUtils(unittest.TestCase):
             textutils.downcode(text),
             "Regionalas attistibas un pasvaldibu lietu ministrijas uzdevuma."
             )
+        text = 'Dezvoltarea regională în ﬁnanțe: ½ ± 中文 e\u0301'
+        self.assertEqual(
+            textutils.downcode(text),
+            "Dezvoltarea regionala in finante: ½ ± 中文 e"
+            )
+
+    def test__downcode_many(self):
+        texts = ["Чому я не сокіл", "Reģionālās", "Farming"] * 20
+        expected = ["Chomu ya ne sokil", "Regionalas", "Farming"] * 20
+        self.assertEqual(list(textutils.downcode_many(iter(texts))), expected)
+        self.assertEqual(
+            list(textutils.downcode_many(texts, workers=2, chunksize=8)),
+            expected)
 
     def test__remove_nontext(self):
         text = """ Sitran selvityksiä 52 Maaseutu tulevaisuuden merkitysyhteiskunnassa Trendianalyysi Kati Hienonen [*123] ls/"""
@@ -364,6 +928,21 @@ class TestTextUtils(unittest.TestCase):
             textutils.remove_nontext(text),
             """ Sitran selvityksiä 52 Maaseutu tulevaisuuden merkitysyhteiskunnassa Trendianalyysi Kati Hienonen [*123] ls/"""
             )
+        self.assertEqual(
+            textutils.remove_nontext("Αθήνα → Athens ✓\n", accepted="Athens"),
+            "  Athens \n")
+        self.assertEqual(
+            textutils.remove_nontext("a-b]c^d\\e", accepted=set("abcd-]^")),
+            "a-b]c^d")
+
+    def test__remove_nontext_many(self):
+        stream = io.StringIO("Café ✓ 42\nЧому ☺ я\n")
+        self.assertEqual(
+            list(textutils.remove_nontext_many(stream)),
+            ["Café  42\n", "Чому  я\n"])
+        self.assertEqual(
+            list(textutils.remove_nontext_many(["ab12", "c3"], accepted="0123456789")),
+            ["12", "3"])
 
     def test__URLNormalizer(self):
         url = 'https://example.com/app/page1/?limit=32&query#image'
@@ -389,6 +968,65 @@ class TestTextUtils(unittest.TestCase):
         normalized = textutils.URLNormalizer(url)
         self.assertEqual(normalized.ascii, "https://xn--exampl-14a.com/bukwa%C9%99")
 
+    def test__normalize_urls(self):
+        urls = ['https://www.example.com/app/?limit=32',
+                'https://example.',
+                'https://examplę.com/bukwaə',
+                'https://www.example.com/other']
+        result = list(textutils.normalize_urls(urls, ascii=True))
+        for url, normalized in zip(urls, result):
+            expected = textutils.URLNormalizer(url)
+            self.assertEqual(normalized, (expected.uri, expected.domain,
+                                          expected.domain_name, expected.ascii))
+
+        self.assertEqual(result[1], ('', '', '', 'https://example.'))
+        self.assertIs(result[0].domain, result[3].domain)
+        self.assertIs(result[0].domain_name, result[3].domain_name)
+        self.assertIsNone(next(textutils.normalize_urls(urls)).ascii)
+        self.assertFalse(hasattr(textutils.URLNormalizer(urls[0]), '__dict__'))
+
+    def test__canonical_url(self):
+        self.assertEqual(
+            textutils.canonical_url(
+                'HTTP://WWW.Example.COM:80/a/b/?utm_source=x&b=2&a=1&fbclid=z#top'),
+            'http://www.example.com/a/b?a=1&b=2')
+        self.assertEqual(textutils.canonical_url('https://examplę.com:443'),
+                         'https://xn--exampl-14a.com/')
+        self.assertEqual(
+            textutils.canonical_url('https://[::1]:8443/x/#top',
+                                    keep_fragment=True, trailing_slash=True),
+            'https://[::1]:8443/x/#top')
+        self.assertEqual(textutils.canonical_url('example'), 'example')
+        self.assertEqual(
+            textutils.URLNormalizer('https://a.eu/x/?b=1&a=2').canonical,
+            'https://a.eu/x?a=2&b=1')
+        self.assertEqual(textutils.url_fingerprint('https://A.eu/x/'),
+                         textutils.url_fingerprint('https://a.eu/x'))
+
+    def test__URLFingerprintSet(self):
+        urls = ['https://example.com/page/{}?utm_source=feed'.format(i)
+                for i in range(5000)]
+        fingerprints = textutils.URLFingerprintSet(urls)
+        fingerprints.add('https://EXAMPLE.com/page/1/')
+        self.assertEqual(len(fingerprints), 5000)
+        self.assertIn('https://example.com/page/42', fingerprints)
+        self.assertNotIn('https://example.com/page/5000', fingerprints)
+        self.assertEqual(
+            fingerprints.contains_many(['https://example.com/page/7',
+                                        'https://example.org/page/7']),
+            [True, False])
+        self.assertEqual(list(fingerprints), sorted(fingerprints))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'frontier.bin')
+            fingerprints.save(path)
+            self.assertEqual(os.path.getsize(path), 5000 * 8)
+            loaded = textutils.URLFingerprintSet.load(path)
+        self.assertEqual(list(loaded), list(fingerprints))
+        self.assertIn('https://example.com/page/4999', loaded)
+        self.assertRaises(ValueError,
+                          textutils.URLFingerprintSet.from_bytes, b'\x00' * 9)
+
     def test__TextCleaner__cleanup_hard(self):
         text = '...COVID-19 lockdown. https://t.co/efBUX6mydx https://t.co/MCtU22fJ5p'
         self.assertEqual(
@@ -403,6 +1041,38 @@ class TestTextUtils(unittest.TestCase):
         self.assertEqual(textutils.TextCleaner("[69]").cleanup_hard(), '')
 
 
+    def test__TextCleaner__lazy(self):
+        cleaner = textutils.TextCleaner(" a  b \n\n c ")
+        self.assertEqual(cleaner._results, {})
+        self.assertEqual(cleaner.text_clean, "a b\nc")
+        self.assertIs(cleaner.cleanup(), cleaner.text_clean)
+        cleaner.text = "d"
+        self.assertEqual(cleaner.text_clean, "d")
+        self.assertEqual(textutils.TextCleaner(None).text_clean, "")
+        self.assertRaises(AttributeError, textutils.TextCleaner(None).cleanup_hard)
+
+        cleaner.text_clean = "edited"
+        self.assertEqual(cleaner.text_clean, "edited")
+        cleaner.text = " d "
+        self.assertEqual(cleaner.text_clean, "d")
+
+    def test__TextPipeline(self):
+        pipeline = textutils.TextPipeline(
+            'downcode', 'remove_digits', str.upper, 'remove_special', 'strip')
+        self.assertEqual(len(pipeline._passes), 4)
+        self.assertEqual(pipeline(" Reģionālās 2020-ĀŽ "), "REGIONALAS  AZ")
+        self.assertRaises(ValueError, textutils.TextPipeline, 'unknown')
+
+        texts = ["  Reģionālās\n\n 52 ", "[69]"] * 20
+        expected = ["Regionalas", ""] * 20
+        self.assertEqual(
+            list(textutils.clean_corpus(texts, textutils.HARD_CLEANUP)),
+            expected)
+        self.assertEqual(
+            list(textutils.clean_corpus(
+                iter(texts), textutils.HARD_CLEANUP, workers=2, chunksize=8)),
+            expected)
+
     def test__TextCleaner__extract_urls(self):
         text = 'These penguins took a stroll through the quiet streets of Cape Town as residents in South Africa self-isolate amid COVID-19 lockdown. https://t.co/efBUX6mydx https://t.co/MCtU22fJ5p'
         self.assertEqual(
@@ -410,6 +1080,67 @@ class TestTextUtils(unittest.TestCase):
             ['https://t.co/efBUX6mydx', 'https://t.co/MCtU22fJ5p']
             )
 
+    def test__iter_urls(self):
+        text = 'See https://t.co/efBUX6mydx, http://a.eu/x and https://t.co/efBUX6mydx.'
+        expected = ['https://t.co/efBUX6mydx', 'http://a.eu/x',
+                    'https://t.co/efBUX6mydx']
+        self.assertEqual(list(textutils.iter_urls(text)), expected)
+        self.assertEqual(list(textutils.iter_urls(text, distinct=True)),
+                         expected[:2])
+
+        # URLs spanning chunk boundaries.
+        for chunk_size in (1, 3, 8, 20):
+            self.assertEqual(
+                list(textutils.iter_urls(io.StringIO(text), chunk_size=chunk_size)),
+                expected)
+            self.assertEqual(
+                list(textutils.iter_urls(io.BytesIO(text.encode()),
+                                         chunk_size=chunk_size)),
+                expected)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'dump.txt')
+            with open(path, 'w') as fp:
+                fp.write("\n".join([text] * 3))
+            self.assertEqual(
+                list(textutils.iter_urls_file(path, distinct=True)),
+                expected[:2])
+
+            open(path, 'w').close()
+            self.assertEqual(list(textutils.iter_urls_file(path)), [])
+
+
+class TestCmd(unittest.TestCase):
+    records = [
+        {"element": "akash", "created": datetime.datetime(2020, 4, 18, 20, 36)},
+        {"element": "agni", "consort": {"id": "Swaha", "sense": "sight"}},
+    ]
+    expected = [
+        {"element": "akash", "created": "2020-04-18T20:36:00"},
+        {"element": "agni", "consort": {"id": "Swaha", "sense": "sight"}},
+    ]
+
+    def test__ndjson(self):
+        with tempfile.TemporaryDirectory() as path:
+            for name in ("records.ndjson", "records.ndjson.gz"):
+                filename = os.path.join(path, name)
+                self.assertEqual(cmd.write_ndjson(iter(self.records), filename), 2)
+                records = cmd.read_ndjson(filename)
+                self.assertEqual(list(records), self.expected)
+                self.assertEqual(next(cmd.read_ndjson(filename)).element, "akash")
+
+            record = next(cmd.read_ndjson(
+                filename, record_class=containers.LazyRecordDict))
+            self.assertEqual(record.__class__.__name__, "LazyRecordDict")
+
+        stream = io.StringIO()
+        with cmd.NDJSONWriter(stream, batch_size=1) as writer:
+            writer.write(self.records[1])
+        self.assertEqual(stream.getvalue(),
+                         '{"element":"agni","consort":{"id":"Swaha","sense":"sight"}}\n')
+        stream.seek(0)
+        self.assertEqual(next(cmd.read_ndjson(stream)).consort.id, "Swaha")
+
 
 class TestDecorators(unittest.TestCase):
     def test__objectify(self):
@@ -453,6 +1184,119 @@ class TestCalcs(unittest.TestCase):
         out_ = calcs.rescale(in_, 1.)
         self.assertEqual(out_, in_)
 
+    def test__rescale__largest_remainder(self):
+        in_ = {'en': 90, 'fi': 15, 'sk': 2, 'cs': 1}
+        out = calcs.rescale(in_, 10, method='largest_remainder')
+        self.assertEqual(out, {'en': 8, 'fi': 2, 'sk': 0, 'cs': 0})
+
+        out = calcs.rescale(in_, 200, method='largest_remainder')
+        self.assertEqual(out, {'en': 166, 'fi': 28, 'sk': 4, 'cs': 2})
+
+        # Ties go to the earlier keys.
+        out = calcs.rescale({'a': 1, 'b': 1, 'c': 1}, 5, 'largest_remainder')
+        self.assertEqual(out, {'a': 2, 'b': 2, 'c': 1})
+        self.assertRaises(ValueError, calcs.rescale, in_, 10, 'unknown')
+
+    @unittest.skipIf(calcs.numpy is None, "numpy is not installed")
+    def test__rescale_many(self):
+        data = [[90, 15, 2, 1], [0, 0, 0, 0], [1, 1, 1, 0]]
+        out = calcs.rescale_many(data, 10)
+        self.assertEqual(out.tolist(), [[8, 2, 0, 0], [0, 0, 0, 0], [4, 3, 3, 0]])
+        self.assertEqual(out.dtype, calcs.numpy.int64)
+        self.assertEqual(
+            out[0].tolist(),
+            list(calcs.rescale(dict(enumerate(data[0])), 10,
+                               'largest_remainder').values()))
+        self.assertEqual(calcs.rescale_many([[1, 3]], 1.).tolist(), [[.25, .75]])
+        # Intact rows of float data are not truncated.
+        out = calcs.rescale_many([[.5, 1.5], [-.5, .25]], calcs.numpy.int64(4))
+        self.assertEqual(out.tolist(), [[1., 3.], [-.5, .25]])
+        self.assertEqual(out.dtype, calcs.numpy.float64)
+        self.assertEqual(calcs.rescale({"a": 1, "b": 3}, calcs.numpy.int32(8)),
+                         {"a": 2, "b": 6})
+        self.assertRaises(ValueError, calcs.rescale_many, [1, 2], 10)
+        with mock.patch.object(compat, 'numpy', None):
+            with self.assertRaisesRegex(ImportError, 'rescale_many requires numpy'):
+                calcs.rescale_many(data, 10)
+
+    def test__RunningStats(self):
+        values = [2, 4, 4, 4, 5, 5, 7, 9]
+        stats = calcs.RunningStats(iter(values))
+        self.assertEqual((stats.count, stats.mean, stats.min, stats.max),
+                         (8, 5., 2, 9))
+        self.assertAlmostEqual(stats.variance, 4.)
+        self.assertAlmostEqual(stats.std, 2.)
+        self.assertAlmostEqual(stats.sample_variance, 32. / 7)
+
+        merged = calcs.RunningStats(values[:3]).merge(
+            calcs.RunningStats.from_bytes(calcs.RunningStats(values[3:]).to_bytes()))
+        self.assertEqual(len(merged), 8)
+        self.assertAlmostEqual(merged.mean, 5.)
+        self.assertAlmostEqual(merged.variance, 4.)
+        self.assertEqual((merged.min, merged.max), (2, 9))
+
+        empty = calcs.RunningStats()
+        self.assertEqual((empty.min, empty.max, empty.variance), (None, None, 0.))
+        self.assertRaises(ValueError, calcs.RunningStats.from_bytes, b'')
+
+    def test__QuantileSketch(self):
+        values = list(range(100000))
+        random.Random(0).shuffle(values)
+        sketch = calcs.QuantileSketch(k=200, seed=0)
+        for value in values[:50000]:
+            sketch.add(value)
+        other = calcs.QuantileSketch(k=200, values=values[50000:], seed=1)
+        sketch.merge(calcs.QuantileSketch.from_bytes(other.to_bytes()))
+
+        self.assertEqual(len(sketch), 100000)
+        self.assertLess(sum(len(x) for x in sketch.compactors), 3 * 200)
+        for fraction, estimate in zip(
+                [0., .5, .95, .99, 1.], sketch.quantiles([0., .5, .95, .99, 1.])):
+            self.assertLess(abs(estimate - fraction * 100000), 100000 * .02)
+
+        self.assertIsNone(calcs.QuantileSketch().quantile(.5))
+        self.assertRaises(ValueError, sketch.quantile, 1.5)
+        self.assertRaises(ValueError, sketch.merge, calcs.QuantileSketch(k=100))
+        self.assertRaises(ValueError, calcs.QuantileSketch.from_bytes, b'\x00' * 7)
+
+
+@unittest.skipIf(calcs.numpy is None, "numpy is not installed")
+class TestDatetimeUtils(unittest.TestCase):
+    def test__bucketize(self):
+        start = datetime.datetime(2020, 4, 18, 1, 5)
+        end = datetime.datetime(2020, 4, 18, 20, 50)
+        interval, first, last = datetimeutils.round_datetime_interval(start, end)
+        timestamps = [first - 1, first, first + interval - 1, first + interval,
+                      last - 1, last]
+
+        result = datetimeutils.bucketize(timestamps, start, end)
+        self.assertEqual(result[0], interval)
+        self.assertEqual(result[1][0], first)
+        self.assertEqual(result[1][-1], last - interval)
+        self.assertEqual(result[2].tolist(), [2, 1] + [0] * 37 + [1])
+
+        as_datetime64 = calcs.numpy.array(timestamps, dtype='datetime64[ms]')
+        self.assertEqual(
+            datetimeutils.bucketize(as_datetime64, calcs.numpy.datetime64(start),
+                                    datetimeutils.datetime_to_timestamp(end))[2].tolist(),
+            result[2].tolist())
+
+        sums = datetimeutils.bucketize(timestamps, start, end,
+                                       weights=[1, 2, 3, 4, 5, 6])[2]
+        self.assertEqual(sums[:2].tolist(), [5., 4.])
+        self.assertEqual(sums[-1], 5.)
+
+        day = datetime.date(2020, 4, 18)
+        by_date = datetimeutils.bucketize(timestamps, day, datetime.date(2020, 4, 19))
+        by_datetime = datetimeutils.bucketize(
+            timestamps, datetime.datetime(2020, 4, 18), datetime.datetime(2020, 4, 19))
+        self.assertEqual(by_date[0], by_datetime[0])
+        self.assertEqual(by_date[2].tolist(), by_datetime[2].tolist())
+
+        interval, starts, counts = datetimeutils.bucketize(timestamps, None, None)
+        self.assertEqual(interval, 1800000)
+        self.assertEqual(counts.sum(), len(timestamps))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -8,6 +8,7 @@ PROJECT_DIR = os.path.dirname(BASE_DIR)
 if PROJECT_DIR not in sys.path:
     sys.path.append(PROJECT_DIR)
 
+from .compat import *
 from .containers import *
 from .textutils import *
 from .datetimeutils import *
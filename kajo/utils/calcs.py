@@ -3,35 +3,455 @@
 """Calculations (re-scaling, etc.)"""
 
 
-from math import ceil
+import sys
+import random
+import numbers
+import struct
+from array import array
+from math import ceil, floor, sqrt, inf
+from heapq import nlargest
+from bisect import bisect_left
 
+from .compat import numpy, require_numpy
 
-def rescale(data, maximum):
+
+def rescale(data, maximum, method='ceil'):
     """
     Crude and simple rescaling of the numeric values
     of `data` to the maximum number `maximum`.
 
+    With integer `maximum` the values are rounded so that they sum
+    up to `maximum` exactly, using `method`:
+    - 'ceil' rounds all values up, then takes 1 from the smallest
+      ones until the total fits
+    - 'largest_remainder' (Hamilton's method) rounds all values
+      down, then adds 1 to those with the largest fractional parts
+
     :param data: <dict> in the form of {key: val <float> or <int>}
+    :param maximum: <int> or <float>
+    :param method: <str> 'ceil' or 'largest_remainder'
     :return: <dict> if the same structure.
     """
     total = float(sum(data.values()))
     if total <= 0.:
         return data
 
-    conv = lambda x: ceil(x) if isinstance(maximum, int) else x
-    scaled = []
-    for key, val in data.items():
-        scaled.append({'key': key, 'val': conv(val / total * maximum)})
+    if not isinstance(maximum, numbers.Integral):
+        return dict((key, val / total * maximum) for key, val in data.items())
+
+    if method == 'largest_remainder':
+        return _largest_remainder(data, total, maximum)
+    if method != 'ceil':
+        raise ValueError("Unknown rescaling method '{}'".format(method))
+
+    keys = list(data.keys())
+    scaled = [ceil(val / total * maximum) for val in data.values()]
+    order = sorted(range(len(scaled)), key=scaled.__getitem__)
 
     # Adjust resulting total to maximum integer
     # (.ceil can raise it a little).
-    if isinstance(maximum, int):
-        scaled = sorted(scaled, key=lambda x: x['val'])
-        scaled_size = len(scaled)
-        i = 0
-        while (sum(x['val'] for x in scaled) > maximum) and (i < scaled_size):
-            new_val = max(0, scaled[i]['val']-1)
-            scaled[i]['val'] = new_val
-            i += 1
-
-    return dict((x['key'], x['val']) for x in scaled)
+    scaled_sum = sum(scaled)
+    for index in order:
+        if scaled_sum <= maximum:
+            break
+        new_val = max(0, scaled[index] - 1)
+        scaled_sum -= scaled[index] - new_val
+        scaled[index] = new_val
+
+    return dict((keys[index], scaled[index]) for index in order)
+
+
+def _largest_remainder(data, total, maximum):
+    keys = list(data.keys())
+    quotas = [val * maximum / total for val in data.values()]
+    scaled = [floor(quota) for quota in quotas]
+
+    # Ties are resolved in favour of the earlier keys.
+    remaining = maximum - sum(scaled)
+    for index in nlargest(remaining, range(len(quotas)),
+                          key=lambda x: quotas[x] - scaled[x]):
+        scaled[index] += 1
+
+    return dict(zip(keys, scaled))
+
+
+def rescale_many(data, maximum, method='largest_remainder'):
+    """
+    Vectorized `rescale` of a batch of distributions: every row
+    of 2-D `data` is rescaled to `maximum` at once. Rows with
+    non-positive totals are returned intact. Requires numpy.
+
+    :param data: 2-D <numpy.ndarray> or a sequence of equally long
+                 sequences of numbers
+    :param maximum: <int> or <float>
+    :param method: <str> only 'largest_remainder' is vectorized
+    :return: <numpy.ndarray> of the same shape: float64 with float
+             `maximum`; with integer `maximum` int64 for integer
+             `data`, otherwise float64 holding whole numbers (so that
+             intact rows are not truncated)
+    """
+    require_numpy('rescale_many')
+    if method != 'largest_remainder':
+        raise ValueError("Unknown rescaling method '{}'".format(method))
+
+    data = numpy.asarray(data)
+    integral = data.dtype.kind in 'biu'
+    data = data.astype(numpy.float64, copy=False)
+    if data.ndim != 2:
+        raise ValueError("Expected 2-D data, got {}-D".format(data.ndim))
+
+    totals = data.sum(axis=1, keepdims=True)
+    valid = totals[:, 0] > 0.
+    quotas = data * maximum / numpy.where(valid[:, None], totals, 1.)
+    if not isinstance(maximum, numbers.Integral):
+        return numpy.where(valid[:, None], quotas, data)
+
+    scaled = numpy.floor(quotas)
+    remaining = maximum - scaled.sum(axis=1)
+
+    # Rank of the fractional part of each value within its row
+    # (0 for the largest), ties in favour of the earlier columns.
+    order = numpy.argsort(scaled - quotas, axis=1, kind='stable')
+    ranks = numpy.empty_like(order)
+    numpy.put_along_axis(
+        ranks, order, numpy.arange(data.shape[1])[None, :], axis=1)
+
+    scaled += ranks < remaining[:, None]
+    scaled = numpy.where(valid[:, None], scaled, data)
+    return scaled.astype(numpy.int64) if integral else scaled
+
+
+def _as_numpy(values):
+    # Returns `values` as a flat float64 array, if it is worth it.
+    if numpy is not None and isinstance(values, (numpy.ndarray, list, tuple, array)):
+        return numpy.asarray(values, dtype=numpy.float64).ravel()
+    return None
+
+
+class RunningStats:
+    """
+    Streaming descriptive statistics: count, mean, variance (Welford's
+    algorithm), min and max, computed in constant memory. Instances
+    computed separately (e.g. by workers) can be merged.
+
+    Example:
+    In [1]: stats = RunningStats()
+    In [2]: stats.update([1, 2, 3, 4])
+    In [3]: stats.mean, stats.variance
+    Out[3]: (2.5, 1.25)
+    """
+    __slots__ = ('count', 'mean', '_m2', '_min', '_max')
+
+    _STRUCT = struct.Struct('<qdddd')
+
+    def __init__(self, values=()):
+        """
+        :param values: iterable of numbers
+        """
+        self.count = 0
+        self.mean = 0.
+        self._m2 = 0.
+        self._min = inf
+        self._max = -inf
+        self.update(values)
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if value < self._min:
+            self._min = value
+        if value > self._max:
+            self._max = value
+
+    def update(self, values):
+        """
+        Adds all `values`; arrays, lists and tuples are processed
+        by numpy in one go, if it is installed.
+        """
+        batch = _as_numpy(values)
+        if batch is None:
+            for value in values:
+                self.add(value)
+            return
+
+        if len(batch):
+            other = RunningStats()
+            other.count = len(batch)
+            other.mean = float(batch.mean())
+            other._m2 = float(numpy.square(batch - other.mean).sum())
+            other._min = float(batch.min())
+            other._max = float(batch.max())
+            self.merge(other)
+
+    def merge(self, other):
+        """
+        Merges statistics of `other` into this instance
+        (Chan's parallel algorithm).
+        """
+        if not other.count:
+            return self
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self._m2 += other._m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self._min = min(self._min, other._min)
+        self._max = max(self._max, other._max)
+        return self
+
+    @property
+    def min(self): return self._min if self.count else None
+
+    @property
+    def max(self): return self._max if self.count else None
+
+    @property
+    def variance(self):
+        """Population variance."""
+        return self._m2 / self.count if self.count else 0.
+
+    @property
+    def sample_variance(self):
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.
+
+    @property
+    def std(self):
+        return sqrt(self.variance)
+
+    def __len__(self):
+        return self.count
+
+    def to_bytes(self):
+        return self._STRUCT.pack(
+            self.count, self.mean, self._m2, self._min, self._max)
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) != cls._STRUCT.size:
+            raise ValueError("Corrupted data")
+        inst = cls()
+        inst.count, inst.mean, inst._m2, inst._min, inst._max = \
+            cls._STRUCT.unpack(data)
+        return inst
+
+    def __repr__(self):
+        return '{}(count={}, mean={}, std={}, min={}, max={})'.format(
+            self.__class__.__name__,
+            self.count, self.mean, self.std, self.min, self.max)
+
+
+class QuantileSketch:
+    """
+    KLL sketch of a stream of numbers: estimates quantiles (p50,
+    p99, etc.) with rank error of approx. 1.7 / `k` (0.17% with the
+    default `k`) and keeps less than 3 * `k` numbers, however long
+    the stream is. Sketches of separate streams can be merged.
+
+    Items are kept in compactors of growing weight: once a compactor
+    is full, it is sorted and every other item (starting randomly at
+    the first or the second) is promoted to the next one.
+
+    Example:
+    In [1]: sketch = QuantileSketch()
+    In [2]: sketch.update(range(1, 1001))
+    In [3]: sketch.quantiles([.5, .95, .99])
+    Out[3]: [500.0, 950.0, 990.0]
+    """
+    _HEADER = struct.Struct('<IqI')
+
+    def __init__(self, k=1000, values=(), seed=None):
+        """
+        :param k: <int> accuracy parameter
+        :param values: iterable of numbers
+        :param seed: seed of the random generator (for reproducible
+                     results)
+        """
+        if k < 8:
+            raise ValueError("k must be at least 8")
+
+        self.k = k
+        self.count = 0
+        self.compactors = [[]]
+        self._random = random.Random(seed)
+        self._size = 0
+        self._max_size = self._capacity(0)
+        self.update(values)
+
+    def _capacity(self, level):
+        depth = len(self.compactors) - level - 1
+        return int(ceil((2. / 3.) ** depth * self.k)) + 1
+
+    def _grow(self):
+        self.compactors.append([])
+        self._max_size = sum(self._capacity(x)
+                             for x in range(len(self.compactors)))
+
+    def _halve(self, items):
+        # Sorted `items` -> every other one, starting randomly.
+        return items[self._random.getrandbits(1)::2]
+
+    def _compress(self):
+        for level, items in enumerate(self.compactors):
+            if len(items) < self._capacity(level):
+                continue
+            if level + 1 == len(self.compactors):
+                self._grow()
+
+            items.sort()
+            # Odd item stays to keep the weights right.
+            kept = [items.pop()] if len(items) % 2 else []
+            self.compactors[level + 1].extend(self._halve(items))
+            self.compactors[level] = kept
+
+            self._size = sum(len(x) for x in self.compactors)
+            if self._size < self._max_size:
+                break
+
+    def add(self, value):
+        self.compactors[0].append(value)
+        self.count += 1
+        self._size += 1
+        if self._size >= self._max_size:
+            self._compress()
+
+    def update(self, values):
+        """
+        Adds all `values`. Arrays, lists and tuples are sorted and
+        halved by numpy directly, if it is installed.
+        """
+        batch = _as_numpy(values)
+        if batch is None:
+            for value in values:
+                self.add(value)
+            return
+
+        self.count += len(batch)
+        level = 0
+        while len(batch) >= self._capacity(level):
+            if level + 1 == len(self.compactors):
+                self._grow()
+            batch = numpy.sort(batch)
+            if len(batch) % 2:
+                self.compactors[level].append(float(batch[-1]))
+                batch = batch[:-1]
+            batch = self._halve(batch)
+            level += 1
+
+        self.compactors[level].extend(batch.tolist())
+        self._size = sum(len(x) for x in self.compactors)
+        if self._size >= self._max_size:
+            self._compress()
+
+    def merge(self, other):
+        """Merges `other` sketch (of the same `k`) into this one."""
+        if other.k != self.k:
+            raise ValueError("Cannot merge sketches of different k")
+
+        while len(self.compactors) < len(other.compactors):
+            self._grow()
+        for level, items in enumerate(other.compactors):
+            self.compactors[level].extend(items)
+
+        self.count += other.count
+        self._size = sum(len(x) for x in self.compactors)
+        if self._size >= self._max_size:
+            self._compress()
+        return self
+
+    def _weighted(self):
+        # Sorted items and their cumulative weights.
+        if numpy is not None:
+            items = numpy.concatenate(
+                [numpy.asarray(x, dtype=numpy.float64) for x in self.compactors])
+            weights = numpy.concatenate(
+                [numpy.full(len(x), 2 ** level, dtype=numpy.int64)
+                 for level, x in enumerate(self.compactors)])
+            order = numpy.argsort(items, kind='stable')
+            return items[order], numpy.cumsum(weights[order])
+
+        pairs = sorted((item, 2 ** level)
+                       for level, items in enumerate(self.compactors)
+                       for item in items)
+        cumulative, total = [], 0
+        for _, weight in pairs:
+            total += weight
+            cumulative.append(total)
+        return [x for x, _ in pairs], cumulative
+
+    def quantiles(self, fractions):
+        """
+        Estimates quantiles of the stream.
+
+        :param fractions: iterable of <float> in range 0..1
+        :return: <list> of numbers (None for an empty sketch)
+        """
+        fractions = list(fractions)
+        if not self._size:
+            return [None] * len(fractions)
+
+        if not all(0. <= fraction <= 1. for fraction in fractions):
+            raise ValueError("Quantile must be in range 0..1")
+
+        items, cumulative = self._weighted()
+        total = cumulative[-1]
+        if numpy is not None:
+            indices = numpy.searchsorted(
+                cumulative, numpy.asarray(fractions, dtype=numpy.float64) * total)
+            return items[numpy.minimum(indices, len(items) - 1)].tolist()
+
+        result = []
+        for fraction in fractions:
+            index = bisect_left(cumulative, fraction * total)
+            result.append(float(items[min(index, len(items) - 1)]))
+
+        return result
+
+    def quantile(self, fraction):
+        return self.quantiles([fraction])[0]
+
+    def __len__(self):
+        return self.count
+
+    def to_bytes(self):
+        """Serializes the sketch (e.g. to be merged by another process)."""
+        chunks = [self._HEADER.pack(self.k, self.count, len(self.compactors))]
+        for items in self.compactors:
+            data = array('d', items)
+            if sys.byteorder == 'big':
+                data.byteswap()
+            chunks.append(struct.pack('<I', len(data)))
+            chunks.append(data.tobytes())
+        return b''.join(chunks)
+
+    @classmethod
+    def from_bytes(cls, data, seed=None):
+        try:
+            k, count, levels = cls._HEADER.unpack_from(data)
+            inst = cls(k, seed=seed)
+            offset = cls._HEADER.size
+            compactors = []
+            for _ in range(levels):
+                size, = struct.unpack_from('<I', data, offset)
+                offset += 4
+                items = array('d', data[offset:offset + size * 8])
+                if len(items) != size:
+                    raise ValueError
+                if sys.byteorder == 'big':
+                    items.byteswap()
+                compactors.append(items.tolist())
+                offset += size * 8
+        except (struct.error, ValueError):
+            raise ValueError("Corrupted data")
+
+        if offset != len(data):
+            raise ValueError("Corrupted data")
+
+        while len(inst.compactors) < levels:
+            inst._grow()
+        inst.compactors = compactors or [[]]
+        inst.count = count
+        inst._size = sum(len(x) for x in compactors)
+        return inst
@@ -5,8 +5,12 @@
 import subprocess
 import tempfile
 import errno
+import gzip
+import json
 from contextlib import contextmanager
 
+from .containers import RecordDict, RecordEncoder
+
 
 class CommandLineError(Exception):
     """
@@ -83,3 +87,115 @@ def as_file(bytes_):
     with tempfile.NamedTemporaryFile() as tfile:
         tfile.write(bytes_)
         yield tfile.name
+
+
+def _open_text(path, mode, compress=None, buffer_size=-1):
+    """Opens `path` as UTF-8 text, gzipped if `compress` or '*.gz'."""
+    if compress is None:
+        compress = str(path).endswith('.gz')
+    if compress:
+        return gzip.open(path, mode + 't', encoding='utf-8')
+
+    return open(path, mode, buffering=buffer_size, encoding='utf-8')
+
+
+class NDJSONWriter:
+    """
+    Writes records to newline-delimited JSON (one record per line),
+    converting values unknown to JSON the same way as
+    `prepare_to_serialize` does, but without touching the records.
+    Lines are written in batches, so memory doesn't depend on the
+    number of records.
+
+    Example:
+    In [1]: with NDJSONWriter('records.ndjson.gz') as writer:
+       ...:     writer.write_many(records)
+    """
+    def __init__(self, path, compress=None, batch_size=1000,
+                 buffer_size=2**20):
+        """
+        :param path: <str> file path or writable text file-like object
+        :param compress: <bool> gzip the output; by default - if
+                                `path` ends with '.gz'
+        :param batch_size: <int> number of lines joined per write
+        :param buffer_size: <int> file buffer size (bytes)
+        """
+        self._own = not hasattr(path, 'write')
+        if self._own:
+            self.fp = _open_text(path, 'w', compress, buffer_size)
+        else:
+            self.fp = path
+        self.batch_size = batch_size
+        self.count = 0
+        self._lines = []
+        self._encode = RecordEncoder(ensure_ascii=False,
+                                     separators=(',', ':')).encode
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, record):
+        self._lines.append(self._encode(record))
+        self.count += 1
+        if len(self._lines) >= self.batch_size:
+            self.flush()
+
+    def write_many(self, container):
+        """
+        :param container: iterable of <dict>'s or <RecordDict>'s
+        :return: <int> number of records written so far
+        """
+        for record in container:
+            self.write(record)
+
+        return self.count
+
+    def flush(self):
+        if self._lines:
+            self._lines.append('')
+            self.fp.write('\n'.join(self._lines))
+            self._lines = []
+
+    def close(self):
+        self.flush()
+        if self._own:
+            self.fp.close()
+        else:
+            self.fp.flush()
+
+
+def write_ndjson(container, path, compress=None, **kwargs):
+    """
+    Writes records from `container` to newline-delimited JSON.
+    See `NDJSONWriter` for the parameters.
+
+    :return: <int> number of records written
+    """
+    with NDJSONWriter(path, compress=compress, **kwargs) as writer:
+        return writer.write_many(container)
+
+
+def read_ndjson(path, compress=None, record_class=RecordDict):
+    """
+    A generator that reads newline-delimited JSON line by line
+    and yields records as `record_class` (e.g. <LazyRecordDict>).
+
+    :param path: <str> file path or readable text file-like object
+    :param compress: <bool> gunzip the input; by default - if
+                            `path` ends with '.gz'
+    """
+    if hasattr(path, 'read'):
+        lines = path
+    else:
+        lines = _open_text(path, 'r', compress)
+
+    try:
+        for line in lines:
+            if line.strip():
+                yield record_class(**json.loads(line))
+    finally:
+        if lines is not path:
+            lines.close()
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+
+"""Optional dependencies shared by the other modules."""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def require_numpy(feature):
+    """
+    Raises <ImportError> naming `feature` if numpy is not installed.
+
+    :param feature: <str> name of the function that needs numpy
+    """
+    if numpy is None:
+        raise ImportError("{} requires numpy".format(feature))
@@ -2,10 +2,23 @@
 
 """Operations with container-like classes (lists, dictionaries, etc.)"""
 
+import os
 import re
 import json
-from collections.abc import Mapping, MutableMapping
-from datetime import datetime
+import base64
+from array import array
+from collections import Counter
+from collections.abc import ItemsView, Mapping, MutableMapping, ValuesView
+from datetime import date
+from decimal import Decimal
+from functools import lru_cache
+from hashlib import blake2b
+from heapq import heapify, heappop, heappush, heapreplace, nlargest
+from math import log
+from numbers import Number
+from uuid import UUID
+
+from .compat import numpy, require_numpy
 
 
 class RecordDict(dict):
@@ -19,12 +32,15 @@ class RecordDict(dict):
             self[key] = self._objectify_recoursive(val)
         self.__dict__ = self
 
-    def _restructure(self, new_dict):
+    def _restructure(self, new_dict, objectify=True):
         for key in list(self.keys()):
             del self[key]
 
-        for key, val in new_dict.items():
-            self[key] = self._objectify_recoursive(val)
+        if not objectify:
+            dict.update(self, new_dict)
+        else:
+            for key, val in new_dict.items():
+                self[key] = self._objectify_recoursive(val)
         self.__dict__ = self
 
     def exclude(self, *args):
@@ -34,19 +50,18 @@ class RecordDict(dict):
 
     def _objectify_recoursive(self, branch):
         if isinstance(branch, dict):
-            for key, val in branch.items():
-                branch[key] = self._objectify_recoursive(val)
-        elif isinstance(branch, (list, tuple)):
+            # The constructor objectifies its own copy of `branch`,
+            # leaving the original intact.
+            return self.__class__(**branch)
+
+        if isinstance(branch, (list, tuple)):
             result = []
             for elem in branch:
                 elem = self._objectify_recoursive(elem)
                 result.append(elem)
             return result
 
-        else:
-            return branch
-
-        return self.__class__(**branch)
+        return branch
 
     @classmethod
     def from_list(cls, container, key, val):
@@ -125,6 +140,22 @@ class RecordDict(dict):
                 kwargs[rec[key]] = [rec[val]]
         return cls(**kwargs)
 
+    @classmethod
+    def group_by(cls, container, key, aggregates=None, delimiter='.'):
+        """
+        Generalization of `self.from_list_aggregate`: groups any
+        iterable of <dict>'s by `key` (key path, or a list of them)
+        keeping only running aggregates per group (see <GroupBy>).
+
+        Example:
+        In [1]: obj = RecordDict.group_by(
+                    input, 'label', {'n': 'count', 'texts': ('collect', 'text')})
+        In [2]: obj.GPE.n
+        Out[2]: 3
+        """
+        groups = GroupBy(key, aggregates, delimiter=delimiter)
+        return groups.update(container).result(cls)
+
     def lookup(self, *paths, default=None, delimiter='.'):
         """
         Iterates through *paths and return the first found value
@@ -171,25 +202,27 @@ class RecordDict(dict):
         The engine behind self.lookup: returns the value from
         a nested dictionary with the help of key path.
         """
-        path = path.split(delimiter)
-        if len(path) == 1:
-            return self.get(path[0], default)
+        return compile_path(path, delimiter).get(self, default)
 
-        # Assume that `path` is a list of recursively accessible dicts.
-        def _get_one_level(key_list, level, container):
-            if level >= len(key_list):
-                if level > len(key_list):
-                    raise IndexError
-                return container[key_list[level-1]]
+    def set_path(self, path, value, delimiter='.'):
+        """
+        Sets the value in a nested dictionary by key path,
+        creating missing intermediate levels.
 
-            return _get_one_level(key_list,
-                                  level+1,
-                                  container[key_list[level-1]])
+        Example:
+        In [1]: data = RecordDict(**{'lang': {'en': {'label': 'Eng'}}})
+        In [2]: data.set_path('lang.pl.label', 'Polish')
+        In [3]: data.lang.pl.label
+        Out[3]: 'Polish'
+        """
+        compile_path(path, delimiter).set(self, value)
 
-        try:
-            return _get_one_level(path, 1, self)
-        except KeyError:
-            return default
+    def delete_path(self, path, delimiter='.'):
+        """
+        Deletes the value from a nested dictionary by key path.
+        Raises KeyError if the path doesn't exist.
+        """
+        compile_path(path, delimiter).delete(self)
 
     def flatten(self, separator='_'):
         """
@@ -230,13 +263,913 @@ class RecordDict(dict):
 
          :return: None
          """
+        # Leaves are objectified already, no need to do it again.
         flat = flatten_dict(self, separator=separator)
-        self._restructure(flat)
+        self._restructure(flat, objectify=False)
+
+    def unflatten(self, separator='_'):
+        """
+        Restores the nested structure flattened by `self.flatten`.
+        Warning: destructive, and keys that contain `separator`
+                 themselves are split too.
+
+        :return: None
+        """
+        self._restructure(unflatten(self, separator=separator))
 
     def update(self, new_dict):
         """Override .update() with the behavior of deep_update."""
         deep_update(self, new_dict)
 
+    def merge(self, *overrides):
+        """
+        Non-destructive version of `self.update`: returns a new
+        <RecordDict> with `overrides` applied (see `deep_merge`).
+        """
+        return deep_merge(self, *overrides)
+
+    def copy(self):
+        """Shallow copy that keeps the class and doesn't re-objectify."""
+        new = self.__class__.__new__(self.__class__)
+        dict.update(new, self)
+        new.__dict__ = new
+        return new
+
+
+class LazyRecordDict(RecordDict):
+    """
+    <RecordDict> that wraps nested dicts and lists only on the
+    first access to them and caches the result, instead of walking
+    the whole tree in the constructor. Construction costs
+    O(top-level keys) regardless of the size of the payload.
+
+    Example:
+    In [1]: obj = LazyRecordDict(**{'lang': {'en': {'label': 'Eng'}}})
+    In [2]: dict.__getitem__(obj, 'lang')
+    Out[2]: {'en': {'label': 'Eng'}}       # still a plain <dict>
+
+    In [3]: obj.lang.en.label
+    Out[3]: 'Eng'
+
+    In [4]: type(dict.__getitem__(obj, 'lang'))
+    Out[4]: LazyRecordDict                   # wrapped and cached
+    """
+    __slots__ = ('_pending',)
+
+    def __init__(self, **kwargs):
+        dict.__init__(self, **kwargs)
+        object.__setattr__(self, '_pending', set(
+            key for key, val in dict.items(self)
+            if LazyRecordDict._is_raw(val)))
+        # Same aliasing as <RecordDict> (e.g. for `vars()`); attribute
+        # reads go through `__getattribute__` to wrap values lazily.
+        object.__setattr__(self, '__dict__', self)
+
+    def __getattribute__(self, key):
+        # Like <RecordDict>, stored keys shadow methods (`obj.items`).
+        if key != '_pending' and dict.__contains__(self, key):
+            return LazyRecordDict.__getitem__(self, key)
+        return object.__getattribute__(self, key)
+
+    @staticmethod
+    def _is_raw(val):
+        """Values that have to be wrapped on first access."""
+        if isinstance(val, (list, tuple)):
+            return True
+        return isinstance(val, dict) and not isinstance(val, RecordDict)
+
+    def _objectify_recoursive(self, branch):
+        """Wraps one level only - nested dicts are wrapped lazily."""
+        if isinstance(branch, dict):
+            if isinstance(branch, RecordDict):
+                return branch
+            return type(self)(**branch)
+
+        if isinstance(branch, (list, tuple)):
+            return [type(self)._objectify_recoursive(self, elem)
+                    for elem in branch]
+
+        return branch
+
+    def _restructure(self, new_dict, objectify=True):
+        dict.clear(self)
+        dict.update(self, new_dict)
+        self._pending.clear()
+        self._pending.update(key for key, val in new_dict.items()
+                             if LazyRecordDict._is_raw(val))
+
+    def __getitem__(self, key):
+        val = dict.__getitem__(self, key)
+        pending = self._pending
+        if key in pending:
+            val = type(self)._objectify_recoursive(self, val)
+            dict.__setitem__(self, key, val)
+            pending.discard(key)
+        return val
+
+    def __setitem__(self, key, val):
+        dict.__setitem__(self, key, val)
+        if LazyRecordDict._is_raw(val):
+            self._pending.add(key)
+        else:
+            self._pending.discard(key)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._pending.discard(key)
+
+    def __setattr__(self, key, val):
+        self[key] = val
+
+    def __delattr__(self, key):
+        try:
+            del self[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key in self:
+            val = self[key]
+            del self[key]
+            return val
+        return dict.pop(self, key, *default)
+
+    def values(self):
+        return _LazyValuesView(self)
+
+    def items(self):
+        return _LazyItemsView(self)
+
+    def __reduce__(self):
+        return (self.__class__, (), None, None, iter(dict.items(self)))
+
+    def copy(self):
+        new = type(self)()
+        dict.update(new, self)
+        new._pending.update(self._pending)
+        return new
+
+
+class _LazyValuesView(ValuesView):
+    """`values()` of <LazyRecordDict>: wraps values as they are read."""
+    __slots__ = ()
+
+    def __reversed__(self):
+        for key in reversed(self._mapping):
+            yield self._mapping[key]
+
+
+class _LazyItemsView(ItemsView):
+    """`items()` of <LazyRecordDict>: wraps values as they are read."""
+    __slots__ = ()
+
+    def __reversed__(self):
+        for key in reversed(self._mapping):
+            yield (key, self._mapping[key])
+
+
+class KeyPath:
+    """
+    Pre-split key path (e.g. 'lang.en.label') to access values
+    of nested dictionaries without re-parsing the path on every call.
+    Use `compile_path` to get cached instances.
+    """
+    __slots__ = ('path', 'delimiter', 'keys')
+
+    def __init__(self, path, delimiter='.'):
+        self.path = path
+        self.delimiter = delimiter
+        self.keys = tuple(path.split(delimiter))
+
+    def __repr__(self):
+        return '{}({!r}, delimiter={!r})'.format(
+            self.__class__.__name__, self.path, self.delimiter)
+
+    def get(self, container, default=None):
+        """Returns the value under the path or `default`."""
+        try:
+            for key in self.keys:
+                container = container[key]
+        except (KeyError, TypeError):
+            return default
+
+        return container
+
+    def set(self, container, value):
+        """
+        Sets the value under the path, creating missing intermediate
+        levels of the same type as their parent.
+        """
+        for key in self.keys[:-1]:
+            try:
+                container = container[key]
+            except KeyError:
+                container[key] = container.__class__()
+                container = container[key]
+
+        container[self.keys[-1]] = value
+
+    def delete(self, container):
+        """Deletes the value under the path, raises KeyError if missing."""
+        for key in self.keys[:-1]:
+            container = container[key]
+
+        del container[self.keys[-1]]
+
+
+@lru_cache(maxsize=1024)
+def compile_path(path, delimiter='.'):
+    """
+    Returns <KeyPath> for `path`, cached per (path, delimiter).
+
+    Example:
+    In [1]: path = compile_path('lang.en.label')
+    In [2]: path.get({'lang': {'en': {'label': 'Eng'}}})
+    Out[2]: 'Eng'
+    """
+    return KeyPath(path, delimiter)
+
+
+def lookup_many(container, *paths, default=None, delimiter='.'):
+    """
+    Extracts values of several key paths from every record of
+    `container` in one pass, returns them as columns.
+
+    Example:
+    In [1]: records = [
+        {'lang': {'label': 'en'}, 'place': {'name': 'Belgium'}},
+        {'lang': {'label': 'fi'}},
+        ]
+    In [2]: lookup_many(records, 'lang.label', 'place.name')
+    Out[2]: {'lang.label': ['en', 'fi'], 'place.name': ['Belgium', None]}
+
+    :param container: iterable of <dict>'s
+    :param paths: <str> key paths
+    :return: <dict> of <list>'s, one per path
+    """
+    compiled = [compile_path(path, delimiter) for path in paths]
+    columns = [[] for _ in compiled]
+    getters = [(path.get, column.append)
+               for path, column in zip(compiled, columns)]
+    for rec in container:
+        for get, append in getters:
+            append(get(rec, default))
+
+    return dict(zip(paths, columns))
+
+
+class _Missing:
+    """Marks keys absent from a record in object columns of <RecordBatch>."""
+    __slots__ = ()
+
+    def __repr__(self):
+        return '<missing>'
+
+    def __reduce__(self):
+        return '_MISSING'
+
+
+_MISSING = _Missing()
+
+
+def _compact_column(values):
+    """
+    Packs a list of values into array('q') if all of them are
+    integers, into array('d') if all of them are numbers, otherwise
+    leaves the list intact. Missing values of numeric columns are
+    stored as 0 (NaN for floats) and marked in the mask.
+
+    :return: (column, <bytearray> mask with 1 for missing values, or None)
+    """
+    if not values:
+        return values, None
+
+    typecode = 'q'
+    missing = 0
+    for val in values:
+        if type(val) is float:
+            typecode = 'd'
+        elif val is _MISSING:
+            missing += 1
+        elif type(val) is not int:
+            return values, None
+
+    if missing == len(values):
+        return values, None
+
+    mask = None
+    if missing:
+        mask = bytearray(val is _MISSING for val in values)
+        filler = float('nan') if typecode == 'd' else 0
+        values = [filler if val is _MISSING else val for val in values]
+
+    try:
+        return array(typecode, values), mask
+    except OverflowError:
+        if mask is not None:
+            values = [_MISSING if missed else val
+                      for val, missed in zip(values, mask)]
+        return values, None
+
+
+class RecordRow:
+    """
+    Read-only view of a single row of <RecordBatch> with the same
+    attribute access as <RecordDict>, i.e. `row.place.location.lat`.
+    """
+    __slots__ = ('_batch', '_index', '_prefix')
+
+    def __init__(self, batch, index, prefix=''):
+        self._batch = batch
+        self._index = index
+        self._prefix = prefix
+
+    def __getitem__(self, key):
+        key = self._prefix + key
+        batch = self._batch
+        if key in batch._columns:
+            val = batch._value(key, self._index)
+            if val is _MISSING:
+                raise KeyError(key)
+            return val
+
+        prefix = key + batch.separator
+        if prefix in batch._prefixes():
+            return self.__class__(batch, self._index, prefix)
+
+        raise KeyError(key)
+
+    def __getattr__(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def __eq__(self, other):
+        if isinstance(other, RecordRow):
+            other = other.to_record()
+        return self.to_record() == other
+
+    def __repr__(self):
+        return repr(self.to_record())
+
+    def to_record(self):
+        """Returns the row (or its branch) as nested <RecordDict>."""
+        return RecordDict(**self._batch._nested(self._index, self._prefix))
+
+
+class RecordBatch:
+    """
+    Columnar container for large lists of homogeneous <dict>'s.
+    Records are flattened to key paths (e.g. 'place.location.lat'),
+    and every key path is stored as a column: integers in array('q'),
+    floats in array('d'), anything else in <list>. Missing numeric
+    values are kept in a mask next to the column (see `mask`). Rows
+    are accessible as <RecordRow> views that support attribute access.
+
+    Warning: empty nested dicts are lost on flattening, and keys
+    must not contain `separator`.
+
+    Example:
+    In [1]: batch = RecordBatch.from_records([
+        {'element': 'akash', 'consort': {'id': 'Bhumi', 'rank': 1}},
+        {'element': 'vayu', 'consort': {'id': 'Lehari', 'rank': 2}},
+        ])
+    In [2]: batch.keys()
+    Out[2]: ['element', 'consort.id', 'consort.rank']
+
+    In [3]: batch[1].consort.id
+    Out[3]: 'Lehari'
+
+    In [4]: batch.column('consort.rank') * 10
+    Out[4]: array([10, 20])
+
+    In [5]: batch.to_records()[0]
+    Out[5]: {'element': 'akash', 'consort': {'id': 'Bhumi', 'rank': 1}}
+    """
+    def __init__(self, columns=None, length=0, separator='.', masks=None):
+        """
+        :param columns: <dict> {key path: <array>, <list> or <ndarray>}
+        :param length: <int> number of rows
+        :param separator: <str> key path separator
+        :param masks: <dict> {key path: <bytearray>} of numeric columns
+                      with missing values (1 for missing)
+        """
+        self._columns = columns or {}
+        self._masks = masks or {}
+        self._length = length
+        self._prefix_cache = None
+        self.separator = separator
+
+    @classmethod
+    def from_records(cls, container, separator='.'):
+        """
+        :param container: iterable of <dict>'s or <RecordDict>'s
+        :param separator: <str> key path separator
+        :return: <RecordBatch>
+        """
+        columns = {}
+        length = 0
+        for rec in container:
+            for key, val in iter_flatten(rec, separator=separator):
+                try:
+                    column = columns[key]
+                except KeyError:
+                    column = columns[key] = [_MISSING] * length
+                column.append(val)
+
+            length += 1
+            for column in columns.values():
+                if len(column) < length:
+                    column.append(_MISSING)
+
+        masks = {}
+        for key, column in columns.items():
+            columns[key], mask = _compact_column(column)
+            if mask is not None:
+                masks[key] = mask
+        return cls(columns, length, separator, masks)
+
+    def to_records(self):
+        """Returns the list of nested <RecordDict>'s."""
+        return [RecordDict(**self._nested(index))
+                for index in range(self._length)]
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(index)
+        return RecordRow(self, index)
+
+    def __iter__(self):
+        for index in range(self._length):
+            yield RecordRow(self, index)
+
+    def __repr__(self):
+        return '{}(rows={}, columns={})'.format(
+            self.__class__.__name__, self._length, self.keys())
+
+    def keys(self):
+        return list(self._columns.keys())
+
+    def column(self, key):
+        """
+        Returns the column by its key path. Numeric columns are
+        returned as <numpy.ndarray> (sharing memory with the storage)
+        if numpy is installed, ready for vectorized operations.
+        Missing values are 0 (NaN for floats), see `mask`.
+        """
+        column = self._columns[key]
+        if numpy is not None and isinstance(column, array):
+            return numpy.frombuffer(column, dtype=column.typecode)
+
+        return column
+
+    def mask(self, key):
+        """
+        Returns the mask of missing values of the numeric column
+        `key` (<numpy.ndarray> of bool if numpy is installed,
+        <bytearray> of 0/1 otherwise), or None if nothing is missing.
+        """
+        if key not in self._columns:
+            raise KeyError(key)
+        mask = self._masks.get(key)
+        if mask is not None and numpy is not None:
+            return numpy.frombuffer(mask, dtype=bool)
+        return mask
+
+    def set_column(self, key, values):
+        """
+        Adds or replaces the column `key` with `values`
+        (e.g. the result of the vectorized operation).
+        """
+        if numpy is not None and isinstance(values, numpy.ndarray) \
+                and values.dtype.kind in 'iuf':
+            column, mask = values, None
+        else:
+            column, mask = _compact_column(list(values))
+
+        if len(column) != self._length:
+            raise ValueError(
+                "Column size {} doesn't match the number of rows {}".format(
+                    len(column), self._length))
+
+        self._columns[key] = column
+        if mask is None:
+            self._masks.pop(key, None)
+        else:
+            self._masks[key] = mask
+        self._prefix_cache = None
+
+    def select(self, indices):
+        """
+        Returns a new <RecordBatch> with rows picked by `indices`
+        (an iterable of <int> or a boolean mask of `len(self)`).
+        """
+        if numpy is not None:
+            if not isinstance(indices, numpy.ndarray):
+                indices = list(indices)
+                if indices and all(isinstance(x, (bool, numpy.bool_))
+                                   for x in indices):
+                    indices = numpy.asarray(indices, dtype=bool)
+            if getattr(indices, 'dtype', None) == bool:
+                indices = numpy.flatnonzero(indices)
+            # An empty list would otherwise become a float64 array.
+            indices = numpy.asarray(indices, dtype=numpy.intp)
+        else:
+            indices = list(indices)
+            if indices and all(isinstance(x, bool) for x in indices):
+                indices = [i for i, x in enumerate(indices) if x]
+
+        columns = {}
+        for key, column in self._columns.items():
+            if isinstance(column, list):
+                columns[key] = [column[i] for i in indices]
+            elif numpy is not None:
+                columns[key] = numpy.asarray(self.column(key))[indices]
+            else:
+                columns[key] = array(column.typecode,
+                                     (column[i] for i in indices))
+
+        masks = {}
+        for key, mask in self._masks.items():
+            mask = bytearray(mask[i] for i in indices)
+            if any(mask):
+                masks[key] = mask
+
+        return self.__class__(columns, len(indices), self.separator, masks)
+
+    def save(self, path):
+        """
+        Saves the batch to the directory `path`: one .npy file
+        per column and the column index in 'columns.json'.
+        Requires numpy.
+        """
+        require_numpy('RecordBatch.save')
+        os.makedirs(path, exist_ok=True)
+        index = []
+        for num, (key, column) in enumerate(self._columns.items()):
+            filename = '{}.npy'.format(num)
+            if isinstance(column, list):
+                values = numpy.empty(len(column), dtype=object)
+                values[:] = column
+            else:
+                values = numpy.asarray(self.column(key))
+            numpy.save(os.path.join(path, filename), values)
+            item = {'key': key,
+                    'file': filename,
+                    'object': isinstance(column, list)}
+            if key in self._masks:
+                item['mask'] = '{}.mask.npy'.format(num)
+                numpy.save(os.path.join(path, item['mask']),
+                           numpy.frombuffer(self._masks[key], dtype=bool))
+            index.append(item)
+
+        with open(os.path.join(path, 'columns.json'), 'w') as fp:
+            json.dump({'length': self._length,
+                       'separator': self.separator,
+                       'columns': index}, fp)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Loads the batch saved by `RecordBatch.save`. Numeric columns
+        are memory-mapped (see `numpy.load` for `mmap_mode`), object
+        columns are read in memory. Requires numpy.
+        """
+        require_numpy('RecordBatch.load')
+        with open(os.path.join(path, 'columns.json')) as fp:
+            index = json.load(fp)
+
+        columns, masks = {}, {}
+        for item in index['columns']:
+            filename = os.path.join(path, item['file'])
+            if item['object']:
+                values = numpy.load(filename, allow_pickle=True).tolist()
+            else:
+                values = numpy.load(filename, mmap_mode=mmap_mode)
+            columns[item['key']] = values
+            if item.get('mask'):
+                masks[item['key']] = bytearray(
+                    numpy.load(os.path.join(path, item['mask'])).tobytes())
+
+        return cls(columns, index['length'], index['separator'], masks)
+
+    def _value(self, key, index):
+        mask = self._masks.get(key)
+        if mask is not None and mask[index]:
+            return _MISSING
+
+        column = self._columns[key]
+        val = column[index]
+        if numpy is not None and isinstance(column, numpy.ndarray):
+            return val.item()
+        return val
+
+    def _prefixes(self):
+        if self._prefix_cache is None:
+            prefixes = set()
+            for key in self._columns:
+                parts = key.split(self.separator)[:-1]
+                for level in range(1, len(parts) + 1):
+                    prefixes.add(
+                        self.separator.join(parts[:level]) + self.separator)
+            self._prefix_cache = prefixes
+
+        return self._prefix_cache
+
+    def _nested(self, index, prefix=''):
+        """Nested <dict> of the row `index` under the key `prefix`."""
+        flat = {}
+        for key in self._columns:
+            if key.startswith(prefix):
+                val = self._value(key, index)
+                if val is not _MISSING:
+                    flat[key[len(prefix):]] = val
+
+        return unflatten(flat, self.separator)
+
+
+class Aggregator:
+    """
+    Running aggregate of the values of a single group, see <GroupBy>.
+    Subclasses keep only the state necessary for `result`.
+    """
+    __slots__ = ()
+
+    def add(self, val):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+class CountAggregator(Aggregator):
+    __slots__ = ('num',)
+
+    def __init__(self):
+        self.num = 0
+
+    def add(self, val):
+        self.num += 1
+
+    def result(self):
+        return self.num
+
+
+class SumAggregator(Aggregator):
+    __slots__ = ('total',)
+
+    def __init__(self):
+        self.total = 0
+
+    def add(self, val):
+        self.total += val
+
+    def result(self):
+        return self.total
+
+
+class MinAggregator(Aggregator):
+    __slots__ = ('val',)
+
+    def __init__(self):
+        self.val = None
+
+    def add(self, val):
+        if self.val is None or val < self.val:
+            self.val = val
+
+    def result(self):
+        return self.val
+
+
+class MaxAggregator(MinAggregator):
+    __slots__ = ()
+
+    def add(self, val):
+        if self.val is None or val > self.val:
+            self.val = val
+
+
+class MeanAggregator(Aggregator):
+    __slots__ = ('total', 'num')
+
+    def __init__(self):
+        self.total = 0
+        self.num = 0
+
+    def add(self, val):
+        self.total += val
+        self.num += 1
+
+    def result(self):
+        return self.total / self.num if self.num else None
+
+
+class FirstAggregator(Aggregator):
+    __slots__ = ('val',)
+
+    def __init__(self):
+        self.val = _MISSING
+
+    def add(self, val):
+        if self.val is _MISSING:
+            self.val = val
+
+    def result(self):
+        return None if self.val is _MISSING else self.val
+
+
+class LastAggregator(FirstAggregator):
+    __slots__ = ()
+
+    def add(self, val):
+        self.val = val
+
+
+class DistinctAggregator(Aggregator):
+    """Distinct values in the order of occurence."""
+    __slots__ = ('seen',)
+
+    def __init__(self):
+        self.seen = {}
+
+    def add(self, val):
+        self.seen[val] = None
+
+    def result(self):
+        return list(self.seen)
+
+
+class CollectAggregator(Aggregator):
+    __slots__ = ('values',)
+
+    def __init__(self):
+        self.values = []
+
+    def add(self, val):
+        self.values.append(val)
+
+    def result(self):
+        return self.values
+
+
+AGGREGATORS = {
+    'count': CountAggregator,
+    'sum': SumAggregator,
+    'min': MinAggregator,
+    'max': MaxAggregator,
+    'mean': MeanAggregator,
+    'first': FirstAggregator,
+    'last': LastAggregator,
+    'distinct': DistinctAggregator,
+    'collect': CollectAggregator,
+    }
+
+
+class GroupBy:
+    """
+    Streaming group-by: consumes records one by one and keeps only
+    running aggregates per group, so memory depends on the number of
+    groups rather than the number of records.
+    Slower than `RecordDict.from_list_aggregate` if the values fit in memory.
+
+    Aggregates are given as a mapping {name: aggregator} or
+    {name: (aggregator, value_path)}, where aggregator is a name from
+    `AGGREGATORS` or an <Aggregator> subclass. Without `value_path`
+    the whole record is aggregated (e.g. for 'count').
+
+    Example:
+    In [1]: input = [
+        {'label': 'GPE', 'text': 'Philippines', 'score': {'conf': .9}},
+        {'label': 'GPE', 'text': 'Nigeria', 'score': {'conf': .7}},
+        {'label': 'ORG', 'text': 'FSC', 'score': {'conf': .8}},
+        ]
+    In [2]: groups = GroupBy('label', {'n': 'count',
+                                       'conf': ('mean', 'score.conf'),
+                                       'texts': ('collect', 'text')})
+    In [3]: groups.update(input)
+    In [4]: groups.result()
+    Out[4]:
+    {'GPE': {'n': 2, 'conf': 0.8, 'texts': ['Philippines', 'Nigeria']},
+     'ORG': {'n': 1, 'conf': 0.8, 'texts': ['FSC']}}
+
+    Composite keys (a list of key paths) produce nested results:
+    In [5]: GroupBy(['lang', 'label'], {'n': 'count'})
+    """
+    def __init__(self, key, aggregates=None, delimiter='.'):
+        """
+        :param key: <str> key path or <list> of key paths; records
+                    without it are grouped under None
+        :param aggregates: <dict> {name: aggregator} or {name:
+                           (aggregator, path)}; by default, counts
+        :param delimiter: <str> key path delimiter
+        """
+        self.composite = isinstance(key, (list, tuple))
+        keys = key if self.composite else [key]
+        self._keys = [compile_path(path, delimiter) for path in keys]
+        self._specs = []
+        for name, spec in (aggregates or {'count': 'count'}).items():
+            path = None
+            if isinstance(spec, (list, tuple)):
+                spec, path = spec
+            if isinstance(spec, str):
+                try:
+                    spec = AGGREGATORS[spec]
+                except KeyError:
+                    raise ValueError("Unknown aggregator '{}'".format(spec))
+            if path is not None:
+                path = compile_path(path, delimiter)
+            self._specs.append((name, spec, path))
+        self._groups = {}
+
+    def __len__(self):
+        return len(self._groups)
+
+    def add(self, rec):
+        self.update((rec,))
+
+    def update(self, container):
+        """
+        :param container: iterable of <dict>'s
+        :return: self
+        """
+        groups = self._groups
+        key_getters = [path.get for path in self._keys]
+        key_get = key_getters[0]
+        factories = [factory for _, factory, _ in self._specs]
+        getters = [path and path.get for _, _, path in self._specs]
+        for rec in container:
+            if self.composite:
+                group = tuple(get(rec) for get in key_getters)
+            else:
+                group = key_get(rec)
+
+            states = groups.get(group)
+            if states is None:
+                states = groups[group] = [factory() for factory in factories]
+
+            for state, get in zip(states, getters):
+                if get is None:
+                    state.add(rec)
+                else:
+                    val = get(rec, _MISSING)
+                    if val is not _MISSING:
+                        state.add(val)
+
+        return self
+
+    def result(self, cls=None):
+        """
+        :param cls: class of the result, <RecordDict> by default
+        :return: {group: {name: aggregate}}, nested per component
+                 of composite keys
+        """
+        cls = cls or RecordDict
+        result = cls()
+        names = [name for name, _, _ in self._specs]
+        for group, states in self._groups.items():
+            aggregated = cls(**dict(
+                zip(names, (state.result() for state in states))))
+            if not self.composite:
+                result[group] = aggregated
+                continue
+
+            node = result
+            for component in group[:-1]:
+                if component not in node:
+                    node[component] = cls()
+                node = node[component]
+            node[group[-1]] = aggregated
+
+        return result
+
+
+def group_by(container, key, aggregates=None, delimiter='.'):
+    """
+    Groups records of `container` (any iterable of <dict>'s) by `key`
+    and aggregates them in a single pass, see <GroupBy>.
+
+    :return: <RecordDict>
+    """
+    groups = GroupBy(key, aggregates, delimiter=delimiter)
+    return groups.update(container).result()
+
 
 def objectify(method):
     """Decorator that converts <dict> to instance of <RecordDict>."""
@@ -261,25 +1194,115 @@ def sniff_json(val):
         return True
 
 
+def _isoformat(val):
+    return val.isoformat()
+
+
+def _base64(val):
+    return base64.b64encode(val).decode('ascii')
+
+
+# Converters of the types unknown to JSON, see `register_json_serializer`.
+JSON_SERIALIZERS = {
+    date: _isoformat,          # and datetime
+    Decimal: str,
+    UUID: str,
+    set: list,
+    frozenset: list,
+    bytes: _base64,
+    bytearray: _base64,
+    }
+if numpy is not None:
+    JSON_SERIALIZERS[numpy.generic] = numpy.generic.item
+    JSON_SERIALIZERS[numpy.ndarray] = numpy.ndarray.tolist
+
+_JSON_TYPES = frozenset((str, int, float, bool, type(None)))
+_SERIALIZERS_CACHE = {}
+
+
+def register_json_serializer(type_, func):
+    """
+    Registers `func` that converts instances of `type_` (and its
+    subclasses) to something JSON can encode.
+
+    Example:
+    In [1]: register_json_serializer(ObjectId, str)
+    """
+    JSON_SERIALIZERS[type_] = func
+    _SERIALIZERS_CACHE.clear()
+
+
+def _get_serializer(type_):
+    try:
+        return _SERIALIZERS_CACHE[type_]
+    except KeyError:
+        pass
+
+    func = None
+    for cls in type_.__mro__:
+        if cls in JSON_SERIALIZERS:
+            func = JSON_SERIALIZERS[cls]
+            break
+    else:
+        if not issubclass(type_, (str, int, float)):
+            func = str
+
+    _SERIALIZERS_CACHE[type_] = func
+    return func
+
+
+def json_default(obj):
+    """
+    Converts `obj` unknown to JSON using `JSON_SERIALIZERS`,
+    falls back to `str`. Use as `json.dumps(obj, default=json_default)`.
+    """
+    func = _get_serializer(type(obj))
+    return obj if func is None else func(obj)
+
+
+class RecordEncoder(json.JSONEncoder):
+    """JSON encoder that understands everything in `JSON_SERIALIZERS`."""
+    def default(self, obj):
+        return json_default(obj)
+
+
+def to_json(obj, fp=None, **kwargs):
+    """
+    Encodes `obj` to JSON in a single pass, converting the types
+    unknown to JSON on the fly (see `JSON_SERIALIZERS`).
+
+    :param obj: <dict>, <list>, etc.
+    :param fp: writable file-like object; if given, the JSON is
+               written there, otherwise returned as <str>
+    :param kwargs: passed to `json.dumps` / `json.dump`
+    :return: <str> or None
+    """
+    if fp is None:
+        return json.dumps(obj, cls=RecordEncoder, **kwargs)
+
+    json.dump(obj, fp, cls=RecordEncoder, **kwargs)
+
+
 def _serialize_recoursive(branch):
-    if sniff_json(branch):
+    # Returns `branch` itself when nothing below it needs converting,
+    # so JSON-safe input (tuples included) is left as it was.
+    if type(branch) in _JSON_TYPES:
         return branch
 
     if isinstance(branch, dict):
         for key, val in branch.items():
-            branch[key] = _serialize_recoursive(val)
+            new_val = _serialize_recoursive(val)
+            if new_val is not val:
+                branch[key] = new_val
     elif isinstance(branch, (list, tuple)):
-        result = []
-        for elem in branch:
-            elem = _serialize_recoursive(elem)
-            result.append(elem)
-        return result
-
+        result = [_serialize_recoursive(elem) for elem in branch]
+        if any(new is not old for new, old in zip(result, branch)):
+            return result
     else:
-        if isinstance(branch, datetime):
-            branch = branch.isoformat()
-        else:
-            branch = str(branch)
+        func = _get_serializer(type(branch))
+        if func is not None:
+            # Converters may return containers (e.g. set -> list).
+            branch = _serialize_recoursive(func(branch))
 
     return branch
 
@@ -288,28 +1311,125 @@ def prepare_to_serialize(dict_):
     """
     Prepares dict to be serialized to JSON, reducing to
     string any struct object (datetime, ObjectID, etc.).
+    Walks the structure once, see `JSON_SERIALIZERS` for conversions.
+    Dicts holding converted values are updated in place; JSON-safe
+    input is returned untouched.
 
     :param dict_: <dict>
     :return: <dict> of the same structure
     """
-    if sniff_json(dict_):
-        return dict_
-
     return _serialize_recoursive(dict_)
 
 
-def flatten_dict(dict_, parent_key='', separator='_'):
-    items = []
-    for key, val in dict_.items():
-        new_key = '{0}{1}{2}'.format(parent_key, separator, key) if parent_key else key
-        if isinstance(val, MutableMapping):
-            items.extend(
-                flatten_dict(val, new_key, separator=separator).items()
-                )
+# Types that are never mappings - saves costly ABC checks on leaves.
+_LEAF_TYPES = frozenset((str, int, float, bool, type(None), list, tuple))
+
+
+def iter_flatten(dict_, parent_key='', separator='_'):
+    """
+    Iterative generator behind `flatten_dict`: yields (flat_key, value)
+    pairs in depth-first order without building intermediate
+    containers, so the depth of `dict_` is not limited by recursion.
+
+    Example:
+    In [1]: list(iter_flatten({'lang': {'label': 'en'}, 'x': 1}))
+    Out[1]: [('lang_label', 'en'), ('x', 1)]
+    """
+    return _iter_flatten(dict_, parent_key, separator)
+
+
+# Max number of joined keys `flatten_many` keeps, so that data-dependent
+# keys (e.g. ids) don't grow the cache with the stream.
+FLATTEN_CACHE_SIZE = 4096
+
+
+def _iter_flatten(dict_, parent_key, separator, joined=None):
+    # `joined` caches flat keys per (prefix, key) across calls. Only
+    # <str> parts are cached: 1, 1.0 and True are equal dict keys,
+    # but are formatted differently.
+    stack = [(parent_key, iter(dict_.items()))]
+    while stack:
+        prefix, items = stack[-1]
+        for key, val in items:
+            if prefix:
+                if (joined is None or type(key) is not str
+                        or type(prefix) is not str):
+                    key = '{0}{1}{2}'.format(prefix, separator, key)
+                else:
+                    path = (prefix, key)
+                    try:
+                        key = joined[path]
+                    except KeyError:
+                        if len(joined) >= FLATTEN_CACHE_SIZE:
+                            joined.clear()
+                        key = '{0}{1}{2}'.format(prefix, separator, key)
+                        joined[path] = key
+            if isinstance(val, dict) or (type(val) not in _LEAF_TYPES
+                                         and isinstance(val, MutableMapping)):
+                stack.append((key, iter(val.items())))
+                break
+            yield key, val
         else:
-            items.append((new_key, val))
+            stack.pop()
+
+
+def flatten_dict(dict_, parent_key='', separator='_'):
+    return dict(iter_flatten(dict_, parent_key, separator))
+
 
-    return dict(items)
+def flatten_many(container, separator='_'):
+    """
+    Generator that flattens every record of `container` (see
+    `flatten_dict`). The joined keys are cached per key path, so
+    records of the same structure share key strings instead of
+    concatenating (and storing) them over and over again. The cache
+    is reset after `FLATTEN_CACHE_SIZE` keys, so memory stays bounded.
+
+    :param container: iterable of <dict>'s
+    :param separator: <str>
+    """
+    joined = {}
+    for rec in container:
+        yield dict(_iter_flatten(rec, '', separator, joined))
+
+
+def unflatten(dict_, separator='_'):
+    """
+    Inverse of `flatten_dict`: splits keys by `separator` and
+    restores the nested structure.
+    Warning: keys that contain `separator` themselves are split too.
+
+    Example:
+    In [1]: unflatten({'lang_label': 'en', 'lang_name': 'English', 'x': 1})
+    Out[1]: {'lang': {'label': 'en', 'name': 'English'}, 'x': 1}
+
+    :param dict_: <dict> with flat keys
+    :param separator: <str>
+    :return: <dict>
+    """
+    result = {}
+    for flat_key, val in dict_.items():
+        if not isinstance(flat_key, str):
+            result[flat_key] = val
+            continue
+
+        keys = flat_key.split(separator)
+        node = result
+        for key in keys[:-1]:
+            if key not in node:
+                node[key] = {}
+            node = node[key]
+            if not isinstance(node, dict):
+                raise ValueError(
+                    "Key '{}' conflicts with a value on the path".format(
+                        flat_key))
+
+        if isinstance(node.get(keys[-1]), dict):
+            raise ValueError(
+                "Key '{}' conflicts with a nested path".format(flat_key))
+        node[keys[-1]] = val
+
+    return result
 
 
 def flatten_list(list_):
@@ -363,6 +1483,168 @@ def distinct_elements(container, preserve_order=False):
     return [x for x in container if not (x in seen or seen_add(x))]
 
 
+def _stable_repr(elm):
+    # `repr` that doesn't depend on the process (unlike memory addresses
+    # of objects or the order of sets of strings), with equal numbers
+    # (1, 1.0, True) spelled alike, as they are equal in a <set>.
+    if elm is None or isinstance(elm, (str, bytes)):
+        return repr(elm)
+    if isinstance(elm, Number):
+        try:
+            if elm == int(elm):
+                return repr(int(elm))
+        except (TypeError, ValueError, OverflowError):
+            pass    # complex, NaN, infinity
+        if isinstance(elm, float):
+            return float.__repr__(elm)
+        return repr(elm)
+    if isinstance(elm, tuple):
+        return '({})'.format(','.join([_stable_repr(x) for x in elm]))
+    raise TypeError("Can't hash64 '{}' stably".format(type(elm).__name__))
+
+
+def hash64(elm):
+    """
+    64-bit hash of `elm` that is stable across processes and runs
+    (unlike built-in `hash` of strings). Equal numbers (1, 1.0, True)
+    get the same hash, <str> and <bytes> of the same text don't.
+
+    :param elm: <str>, <bytes>, a number, None or a <tuple> of them
+    :raises TypeError: for other types, whose hash couldn't be stable
+    """
+    if isinstance(elm, str):
+        data = elm.encode('utf-8')
+    elif isinstance(elm, bytes):
+        data = b'\x01' + elm
+    else:
+        data = b'\x00' + _stable_repr(elm).encode('utf-8')
+
+    return int.from_bytes(blake2b(data, digest_size=8).digest(), 'big')
+
+
+# 2 ** -rank for every possible register value.
+_HLL_POWERS = [2. ** -rank for rank in range(66)]
+
+
+class HyperLogLog:
+    """
+    HyperLogLog estimator of the number of distinct elements: uses
+    2 ** `precision` bytes of memory regardless of the size of the
+    stream, with the standard error of 1.04 / sqrt(2 ** precision)
+    (~0.8% for the default precision 14, i.e. 16 KB).
+
+    Estimators built in different processes (with the same
+    precision) can be merged and serialized to bytes.
+
+    Example:
+    In [1]: users = HyperLogLog()
+    In [2]: users.update(['Siddhartha', 'Varuna', 'Siddhartha'])
+    In [3]: len(users)
+    Out[3]: 2
+    """
+    def __init__(self, precision=14):
+        """
+        :param precision: <int> from 4 to 18
+        """
+        if not 4 <= precision <= 18:
+            raise ValueError("Precision must be in range 4..18")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def __len__(self):
+        return round(self.estimate())
+
+    def __eq__(self, other):
+        return (isinstance(other, HyperLogLog) and
+                self.precision == other.precision and
+                self.registers == other.registers)
+
+    def add(self, elm):
+        self.add_hash(hash64(elm))
+
+    def add_hash(self, hashed):
+        """Adds a pre-computed 64-bit hash (see `hash64`)."""
+        bits = 64 - self.precision
+        index = hashed >> bits
+        rank = bits - (hashed & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, container):
+        registers = self.registers
+        bits = 64 - self.precision
+        mask = (1 << bits) - 1
+        for elm in container:
+            hashed = hash64(elm)
+            index = hashed >> bits
+            rank = bits - (hashed & mask).bit_length() + 1
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def estimate(self):
+        """
+        :return: <float> estimated number of distinct elements
+        """
+        size = len(self.registers)
+        if size >= 128:
+            alpha = 0.7213 / (1 + 1.079 / size)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[size]
+
+        estimate = alpha * size * size / sum(
+            map(_HLL_POWERS.__getitem__, self.registers))
+
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            # Small range correction (linear counting).
+            estimate = size * log(size / zeros)
+
+        return estimate
+
+    def merge(self, other):
+        """
+        Merges `other` <HyperLogLog> into `self`.
+
+        :return: self
+        """
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge estimators of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def to_bytes(self):
+        return bytes([self.precision]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        inst = cls(data[0])
+        if len(data) - 1 != len(inst.registers):
+            raise ValueError("Corrupted data")
+        inst.registers = bytearray(data[1:])
+        return inst
+
+
+def count_distinct(container, approx=True, precision=14):
+    """
+    Counts distinct elements of `container` (any iterable). Unlike
+    `distinct_elements`, with `approx` it doesn't keep the elements
+    in memory, but estimates their number with <HyperLogLog>.
+    Estimating is slower than `approx=False`, which needs a <set>.
+
+    :param container: iterable of hashable elements (with `approx`
+                      only those accepted by `hash64`)
+    :param approx: <bool> estimate (approx. 1% error) or count exactly
+    :param precision: <int> see <HyperLogLog>
+    :return: <int>
+    """
+    if not approx:
+        return len(set(container))
+
+    estimator = HyperLogLog(precision)
+    estimator.update(container)
+    return len(estimator)
+
+
 def deep_update(source, overrides):
     """
     Updates a nested dictionary or similar mapping.
@@ -378,11 +1660,95 @@ def deep_update(source, overrides):
     return source
 
 
+def _shallow_copy(node, owned):
+    if isinstance(node, RecordDict):
+        node = node.copy()
+    else:
+        node = dict(node)
+    owned.add(id(node))
+    return node
+
+
+def _merge_into(target, overrides, owned):
+    for key, value in overrides.items():
+        if isinstance(value, Mapping) and value:
+            branch = target.get(key)
+            if not isinstance(branch, Mapping):
+                branch = target.__class__()
+                owned.add(id(branch))
+            elif id(branch) not in owned:
+                branch = _shallow_copy(branch, owned)
+            _merge_into(branch, value, owned)
+            target[key] = branch
+        else:
+            target[key] = value
+
+
+def deep_merge(base, *overrides):
+    """
+    Copy-on-write version of `deep_update`: merges `overrides` (in
+    order) into a new mapping, leaving all the inputs intact. Only
+    the branches touched by overrides are (shallowly) copied, the rest
+    is shared with `base`, so the cost depends on the size of the
+    overrides rather than the size of `base`.
+
+    Warning: untouched branches are shared, so mutating them in the
+    result mutates `base` as well.
+
+    Example:
+    In [1]: base = {'db': {'host': 'localhost', 'port': 5432}, 'debug': False}
+    In [2]: deep_merge(base, {'db': {'port': 6432}}, {'debug': True})
+    Out[2]: {'db': {'host': 'localhost', 'port': 6432}, 'debug': True}
+
+    :param base: <dict> or <RecordDict>
+    :param overrides: <dict>'s
+    :return: <dict> of the same type as `base`
+    """
+    owned = set()
+    result = _shallow_copy(base, owned)
+    for layer in overrides:
+        _merge_into(result, layer, owned)
+
+    return result
+
+
+RE_SPECIAL = re.compile('[^A-Za-z0-9]+')
+
+
+@lru_cache(maxsize=4096)
+def normalize_key(key, lowercase=True, separator='_'):
+    """
+    Normalized version of a single key (see `normalize_keys`).
+    Results are kept in a bounded LRU cache, since the same key
+    spellings repeat over and over in record streams; see
+    `normalize_keys_cache_info` for its efficiency.
+    """
+    new_key = RE_SPECIAL.sub(separator, key)
+    return new_key.lower() if lowercase else new_key
+
+
+def normalize_keys_cache_info():
+    """
+    Returns statistics of the `normalize_key` cache.
+
+    :return: <RecordDict> with hits, misses, size, maxsize and
+             hit_rate (0..1)
+    """
+    info = normalize_key.cache_info()
+    total = info.hits + info.misses
+    return RecordDict(hits=info.hits,
+                      misses=info.misses,
+                      size=info.currsize,
+                      maxsize=info.maxsize,
+                      hit_rate=info.hits / total if total else 0.)
+
+
 def normalize_keys(dict_, lowercase=True, separator='_'):
     """
     Recoursively changes keys to their normalized version:
     - replaces any special symbol by `separator`
     - lowercases (if necessary).
+    Descends into nested dicts and lists (e.g. lists of dicts).
 
     Example:
     In [1]: input_ = {"Content-Type": "text/html",
@@ -397,16 +1763,36 @@ def normalize_keys(dict_, lowercase=True, separator='_'):
      'last_modified': {'day_of_week': 'Sat', 'day': 4, 'month': 'Apr'}}
     """
     normalized = {}
-    for key, val in dict_.items():
-        new_key = re.sub('[^A-Za-z0-9]+', separator, key)
-        new_key = new_key.lower() if lowercase else new_key
+    stack = [(dict_, normalized)]
+    while stack:
+        source, target = stack.pop()
+        if isinstance(source, dict):
+            for key, val in source.items():
+                if isinstance(val, (dict, list)):
+                    branch = {} if isinstance(val, dict) else []
+                    stack.append((val, branch))
+                    val = branch
+                target[normalize_key(key, lowercase, separator)] = val
+        else:
+            for val in source:
+                if isinstance(val, (dict, list)):
+                    branch = {} if isinstance(val, dict) else []
+                    stack.append((val, branch))
+                    val = branch
+                target.append(val)
 
-        if isinstance(val, dict):
-            val = normalize_keys(val, lowercase, separator)
+    return normalized
 
-        normalized[new_key] = val
 
-    return normalized
+def normalize_keys_many(container, lowercase=True, separator='_'):
+    """
+    A generator that normalizes keys of every record of `container`
+    (see `normalize_keys`).
+
+    :param container: iterable of <dict>'s
+    """
+    for rec in container:
+        yield normalize_keys(rec, lowercase, separator)
 
 
 def compress_and_sort_by_occurence(container, reverse=True, values_only=True):
@@ -437,3 +1823,196 @@ def compress_and_sort_by_occurence(container, reverse=True, values_only=True):
         return [x['elm'] for x in aggregated]
 
     return aggregated
+
+
+class TopK:
+    """
+    Streaming top-k counter (Space-Saving algorithm) with constant
+    memory: keeps at most `capacity` counters no matter how many
+    distinct elements pass through it.
+
+    Every reported count overestimates the true one by at most
+    `self.error(elm)`, which never exceeds `self.error_bound`
+    (= total weight / capacity). All elements whose true count is
+    above `error_bound` are guaranteed to be among the counters.
+    Counters built on different shards can be merged.
+
+    Example:
+    In [1]: topics = TopK(capacity=100)
+    In [2]: topics.update(['covid', 'flood', 'covid', 'election'])
+    In [3]: topics.add('flood', weight=5)
+    In [4]: topics.most_common(2)
+    Out[4]: [('flood', 6), ('covid', 2)]
+    """
+    def __init__(self, capacity=1000):
+        """
+        :param capacity: <int> max number of counters; the larger it
+                         is, the smaller the error
+        """
+        if capacity < 1:
+            raise ValueError("Capacity must be positive")
+        self.capacity = capacity
+        self.total = 0
+        self._counts = {}
+        self._errors = {}
+        self._heap = []
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __contains__(self, elm):
+        return elm in self._counts
+
+    def __getitem__(self, elm):
+        """Estimated count of `elm` (0 if not monitored)."""
+        return self._counts.get(elm, 0)
+
+    @property
+    def error_bound(self):
+        return self.total / self.capacity
+
+    def error(self, elm):
+        """Max overestimation of the count of `elm`."""
+        if elm in self._errors:
+            return self._errors[elm]
+        return self._min_count()
+
+    def add(self, elm, weight=1):
+        if weight <= 0:
+            raise ValueError("Weight must be positive")
+
+        counts = self._counts
+        self.total += weight
+        if elm in counts:
+            counts[elm] += weight
+            return
+
+        if len(counts) < self.capacity:
+            counts[elm] = weight
+            self._errors[elm] = 0
+        else:
+            # Replace the least frequent element, inheriting its
+            # count as the possible error.
+            minimum = self._min_count()
+            _, _, victim = heappop(self._heap)
+            del counts[victim]
+            del self._errors[victim]
+            counts[elm] = minimum + weight
+            self._errors[elm] = minimum
+
+        self._push(elm, counts[elm])
+
+    def update(self, container):
+        """
+        :param container: iterable of elements, or <dict>
+                          {element: weight}
+        """
+        if isinstance(container, Mapping):
+            for elm, weight in container.items():
+                self.add(elm, weight)
+            return
+
+        counts, add = self._counts, self.add
+        hits = 0
+        for elm in container:
+            if elm in counts:
+                counts[elm] += 1
+                hits += 1
+            else:
+                add(elm)
+        self.total += hits
+
+    def merge(self, other):
+        """
+        Merges counters of `other` <TopK> into `self`, keeping the
+        error guarantees for the combined stream.
+
+        :return: self
+        """
+        # Elements missing from a full summary may have been counted
+        # up to its minimum, which goes to both count and error.
+        own_min, other_min = self._min_count(), other._min_count()
+        counts, errors = {}, {}
+        for elm in set(self._counts).union(other._counts):
+            counts[elm] = (self._counts.get(elm, own_min) +
+                           other._counts.get(elm, other_min))
+            errors[elm] = (self._errors.get(elm, own_min) +
+                           other._errors.get(elm, other_min))
+
+        capacity = max(self.capacity, other.capacity)
+        kept = nlargest(capacity, counts, key=counts.get)
+        self.capacity = capacity
+        self.total += other.total
+        self._counts = dict((elm, counts[elm]) for elm in kept)
+        self._errors = dict((elm, errors[elm]) for elm in kept)
+        self._rebuild_heap()
+        return self
+
+    def most_common(self, n=None):
+        """
+        :param n: <int> number of elements, all if None
+        :return: <list> of (element, estimated count), most frequent first
+        """
+        if n is None:
+            n = len(self._counts)
+        return [(elm, self._counts[elm])
+                for elm in nlargest(n, self._counts, key=self._counts.get)]
+
+    def _min_count(self):
+        if len(self._counts) < self.capacity:
+            return 0
+
+        # Heap entries are not updated on increments (counts only
+        # grow), so refresh the top until it is up to date.
+        heap = self._heap
+        while True:
+            minimum, _, elm = heap[0]
+            if self._counts[elm] == minimum:
+                return minimum
+            self._seq += 1
+            heapreplace(heap, (self._counts[elm], self._seq, elm))
+
+    def _push(self, elm, num):
+        # The sequence number breaks ties, so that elements
+        # themselves are never compared.
+        self._seq += 1
+        heappush(self._heap, (num, self._seq, elm))
+
+    def _rebuild_heap(self):
+        self._heap = [(num, seq, elm) for seq, (elm, num)
+                      in enumerate(self._counts.items(), self._seq + 1)]
+        self._seq += len(self._heap)
+        heapify(self._heap)
+
+
+def top_occurences(container, limit=20, capacity=None, values_only=True,
+                   exact=False):
+    """
+    Streaming counterpart of `compress_and_sort_by_occurence` for
+    when only `limit` most frequent elements are needed: memory
+    doesn't depend on the number of distinct elements (see <TopK>).
+    If all distinct elements fit in memory, `exact` is faster.
+
+    :param container: iterable of elements (e.g. <str>)
+    :param limit: <int> number of top elements to return
+    :param capacity: <int> number of counters, default - 10 * `limit`
+                     (ignored with `exact`)
+    :param values_only: <bool> if True, returns list of elements,
+                               otherwise, returns list of dicts
+                               with estimated number of occurences.
+    :param exact: <bool> count exactly, in memory proportional to
+                  the number of distinct elements
+    :return: <list>
+    """
+    if exact:
+        top = Counter(container).most_common(limit)
+    else:
+        counter = TopK(capacity or 10 * limit)
+        counter.update(container)
+        top = counter.most_common(limit)
+
+    if values_only:
+        return [elm for elm, _ in top]
+
+    return [{'elm': elm, 'num': num} for elm, num in top]
@@ -7,6 +7,8 @@ import datetime
 import calendar
 from math import isclose
 
+from .compat import numpy, require_numpy
+
 
 def make_tz_aware(dt, tz=datetime.timezone.utc):
     if isinstance(tz, str):
@@ -93,6 +95,75 @@ def round_datetime_interval(start, end):
     return interval, suggested_start, suggested_end
 
 
+def _as_datetime(value):
+    # Accepts <datetime.datetime>, <datetime.date> (as midnight),
+    # <numpy.datetime64> or epoch ms.
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time())
+    if numpy is not None and isinstance(value, numpy.datetime64):
+        return value.astype('datetime64[ms]').item()
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=value)
+
+
+def bucketize(timestamps, start, end, weights=None):
+    """
+    Vectorized histogram of `timestamps` in time buckets chosen by
+    `round_datetime_interval` for `start` and `end` (if they are
+    missing, the data range is used with the default interval).
+    Buckets are half-open, [bucket_start, bucket_start + interval);
+    timestamps outside of the rounded range are ignored. Requires
+    numpy.
+
+    :param timestamps: array-like of epoch ms <int> or <numpy.datetime64>
+    :param start: <datetime.datetime>, <datetime.date> (midnight),
+                  <numpy.datetime64> or epoch ms
+    :param end: <datetime.datetime>, <datetime.date> (midnight),
+                <numpy.datetime64> or epoch ms
+    :param weights: array-like of numbers of the same length; if
+                    given, they are summed up instead of counting
+    :return: <int> interval (ms),
+             <numpy.ndarray> bucket starts (timestamps),
+             <numpy.ndarray> counts (int64) or sums (float64)
+    """
+    require_numpy('bucketize')
+
+    timestamps = numpy.asarray(timestamps)
+    if numpy.issubdtype(timestamps.dtype, numpy.datetime64):
+        timestamps = timestamps.astype('datetime64[ms]').view(numpy.int64)
+    else:
+        timestamps = timestamps.astype(numpy.int64, copy=False)
+
+    interval, first, last = round_datetime_interval(
+        _as_datetime(start), _as_datetime(end))
+    if first is None:
+        if not len(timestamps):
+            first = last = 0
+        else:
+            first = int(timestamps.min()) // interval * interval
+            last = int(timestamps.max()) // interval * interval + interval
+
+    size = max(-(-(last - first) // interval), 1)
+
+    # Out-of-range timestamps are moved to the extra buckets
+    # -1 and `size`, dropped afterwards.
+    index = timestamps - first
+    index //= interval
+    numpy.clip(index, -1, size, out=index)
+    index += 1
+
+    if weights is None:
+        values = numpy.bincount(index, minlength=size + 2)
+    else:
+        values = numpy.bincount(
+            index, weights=numpy.asarray(weights, dtype=numpy.float64),
+            minlength=size + 2)
+
+    starts = first + numpy.arange(size, dtype=numpy.int64) * interval
+    return interval, starts, values[1:size + 1]
+
+
 def human_readable_time(ms, round_to=3):
     """
     A very crude function for human readable time: